@@ -4,9 +4,11 @@ Uses Entrez to pull associated data for each accession number from BLAST.
 !!! Alternative version that removes duplicates that have same metadata, see below for more info. !!!
 
 Developed by: Fletcher Falk"""
-import Bio, time
+import Bio, os, sys
 from Bio import Entrez
 from xml.etree import ElementTree as ET
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from roseentrez import MAXSEQUENCE, fetchrecords, isgenome
 
 """Entrez formatting 16S from complete genome sequence"""
 def parse16S(metadata, accession):
@@ -29,7 +31,7 @@ def parse16S(metadata, accession):
     return sequence
 
 """Entrez Metadata Function"""
-def metaparser(accessionlist, inputblast):
+def metaparser(accessionlist, inputblast, batchsize = 200, cache = None):
     print("Fetching metadata with Entrez from BLAST results...", "\n")
 
     """Start writing new xml output for metadata by building ElementTree"""
@@ -41,14 +43,15 @@ def metaparser(accessionlist, inputblast):
 
     duplist = []
 
-    """Go through each accession from the input list.
-    Setup like this to allow for sleep at end of loop to follow NCBI Guidelines
-    and prevent overloading requests of all the list at once."""
+    """Fetch with Entrez in batches, skipping accessions already in the cache"""
+    records = fetchrecords(accessionlist, batchsize, cache)
+
+    """Go through each accession from the input list in blast order"""
     for accession in accessionlist:
-        """Fetch with Entrez"""
-        fetch = Entrez.efetch(db = "nucleotide", id = accession, rettype = "gb", retmode = "xml")
-        metadata = Entrez.read(fetch)
-        fetch.close()
+        if accession not in records:
+            print("Entrez returned no record for ", accession, " excluding..")
+            continue
+        metadata = [records[accession]]
 
         host = "blank"
         isosource = "blank"
@@ -76,13 +79,17 @@ def metaparser(accessionlist, inputblast):
             duplist.append(str(metalist))
 
             """Add full sequence for phylogeny"""
-            if "complete genome" or "chromosome" in str(metadata[0]['GBSeq_definition']):
+            if isgenome(str(metadata[0]['GBSeq_definition'])):
                 rRNAsequence = parse16S(metadata, accession)
                 if rRNAsequence == "Error":
                     continue
                 sequence = ET.SubElement(root, "Sequence")
                 ET.SubElement(sequence, "full_Sequence").text = rRNAsequence
             else:
+                """The sequence of records longer than roseentrez.MAXSEQUENCE (scaffolds, plasmids) is not kept"""
+                if metadata[0].get('GBSeq_sequence') is None:
+                    print("No sequence kept for ", accession, " (longer than ", MAXSEQUENCE, " bp and not a genome).. excluding")
+                    continue
                 sequence = ET.SubElement(root, "Sequence")
                 ET.SubElement(sequence, "full_Sequence").text = metadata[0]['GBSeq_sequence']
             
@@ -112,8 +119,6 @@ def metaparser(accessionlist, inputblast):
                             case 'db_xref':
                                 ET.SubElement(source, "db_xref").text = qual['GBQualifier_value']
             count += 1
-        """Sleep to follow appropriate NCBI Guidelines for requests"""
-        time.sleep(0.5)
 
     """Output final xml file"""
     outputxml = ET.ElementTree(root)
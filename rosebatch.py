@@ -0,0 +1,108 @@
+"""Batch renderer for Rosetree
+Renders many figure variants of one tree (metadata columns, rerooted, pruned, pdf/svg) in parallel processes.
+The metadata is parsed once and shared with the worker processes, each variant parses its own copy of the tree
+(copying or pickling a parsed tree recurses once per level and fails on deep trees).
+Variants are a json list, for example:
+[{"name": "tree-host", "columns": ["host", "geo_loc_name"]},
+ {"name": "tree-rooted", "root": "OP595649", "prune": ["OL672320"], "format": "svg", "style": {"show_branch_length": false}}]
+Developed by: Fletcher Falk"""
+import os, json, time, argparse
+from concurrent.futures import ProcessPoolExecutor
+from rosedereplicate import readclustermap
+from roselabels import specieslist, metadataindex, leaflabels
+
+"""Data parsed once in the parent and inherited by each worker"""
+shared = {}
+
+"""Arguments for running the program"""
+def argument_parser():
+    """Arguments"""
+    parser = argparse.ArgumentParser(description="RoseBatch Argument List")
+    parser.add_argument("--input", "-i",
+                        help="Tree file to render, e.g. finaltree.raxml.supportFBP", required=True)
+    parser.add_argument("--variants", "-v",
+                        help="Json file with the list of variants to render", required=True)
+    parser.add_argument("--backend", "-b", choices=["ete", "svg"],
+                        help="Tree renderer: ete (ETE3/Qt) or svg (headless pure Python, no Qt needed), default: svg", default="svg")
+    parser.add_argument("--workers", "-w", type=int,
+                        help="Number of render processes, default: number of cpus", default=os.cpu_count())
+    """Return arguments"""
+    return parser.parse_args()
+
+"""Read the variant list and fill in defaults"""
+def loadvariants(path):
+    with open(path, "r") as variantfile:
+        variants = json.load(variantfile)
+    for number, variant in enumerate(variants):
+        if "name" not in variant:
+            raise ValueError("Variant " + str(number) + " has no name")
+        variant.setdefault("columns", [])
+        variant.setdefault("root", None)
+        variant.setdefault("prune", [])
+        variant.setdefault("format", "pdf")
+        variant.setdefault("style", {})
+        if variant["format"] not in ("pdf", "svg"):
+            raise ValueError("Variant " + variant["name"] + " has unknown format " + variant["format"])
+    return variants
+
+"""Parse the metadata index (all requested columns) and cluster map once"""
+def prepare(inputtree, inputblast, backend, columns):
+    colors, cleanlist = specieslist()
+    return {"backend": backend, "inputtree": inputtree, "inputblast": inputblast,
+            "index": metadataindex(colors, cleanlist, columns), "collapsed": readclustermap()}
+
+"""Worker setup"""
+def initworker(data):
+    shared.update(data)
+
+"""Render one variant on its own parse of the tree"""
+def renderjob(variant):
+    start = time.perf_counter()
+    if shared["backend"] == "svg":
+        from rosesvg import readtree, setoutgroup, prune, draw
+        tree = readtree(shared["inputtree"])
+        if variant["root"]:
+            tree = setoutgroup(tree, variant["root"])
+        if variant["prune"]:
+            tree = prune(tree, variant["prune"])
+        leafnames = [leaf.name for leaf in tree.leaves()]
+    else:
+        from rosephylogeny import loadtree, render
+        tree = loadtree(shared["inputtree"])
+        if variant["root"]:
+            tree.set_outgroup(tree & variant["root"])
+        for name in variant["prune"]:
+            (tree & name).delete(preserve_branch_length = True)
+        leafnames = tree.get_leaf_names()
+    labels = leaflabels(leafnames, shared["index"], shared["inputblast"], shared["collapsed"], variant["columns"])
+    if shared["backend"] == "svg":
+        draw(tree, labels, variant["name"], variant["style"], variant["format"])
+    else:
+        render({"tree": tree, "labels": labels}, variant["name"], variant["style"], variant["format"])
+    return variant["name"] + "." + variant["format"], time.perf_counter() - start
+
+"""Render every variant across a process pool"""
+def batchrender(inputtree, inputblast, variants, backend = "svg", workers = None):
+    columns = sorted({column for variant in variants for column in variant["columns"]})
+    data = prepare(inputtree, inputblast, backend, columns)
+    with ProcessPoolExecutor(max_workers = workers, initializer = initworker, initargs = (data,)) as pool:
+        for output, seconds in pool.map(renderjob, variants):
+            print("Rendered ", output, " in ", round(seconds, 2), "s")
+
+def rosebatch(args):
+    """Phylogeny data for rerun"""
+    with open("phydata", "r") as phydata:
+        inputblast = phydata.readline()
+    variants = loadvariants(args.variants)
+    print("Rendering ", len(variants), " variants of ", args.input, " with ", args.workers, " workers...\n")
+    batchrender(args.input, inputblast, variants, args.backend, args.workers)
+    print("Bye!")
+
+"""Main: sets up arguments and runs program"""
+def main():
+    args = argument_parser()
+    rosebatch(args)
+
+"""Start Program"""
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,24 @@
 """NCBI Blast for Rosetree
 Writes the results of blast into XML for parsing.
 Developed by: Fletcher Falk"""
-import os, time
+import os, re, time, urllib.parse, urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from Bio import Blast
+from rosethrottle import TokenBucket
+from roseexecute import execute
+
+"""NCBI BLAST URL API"""
+BLAST_URL = "https://blast.ncbi.nlm.nih.gov/Blast.cgi"
+"""NCBI guidelines: no more than one request every 10 seconds
+and do not poll a single RID more than once a minute"""
+REQUEST_RATE = 0.1
+POLL_INTERVAL = 60
 
 """Blasts fasta file to NCBI
-Uses qblast from Biopython library"""
-def nuc_blast(path, blastnum, resultnum):
+Uses qblast from Biopython library, or blastn against a local database when backend is local"""
+def nuc_blast(path, blastnum, resultnum, backend = "remote", database = None, threads = 1):
+    if backend == "local":
+        return local_blast(path, blastnum, resultnum, database, threads)
     blastseq = open(path).read()
     """Blast sequence to nucleotide database"""
     blast_results = Blast.qblast("blastn", "nt", blastseq, hitlist_size = blastnum)
@@ -16,19 +28,83 @@ def nuc_blast(path, blastnum, resultnum):
         out_stream.write(blast_results.read())
     blast_results.close()
 
+"""Build a local BLAST+ database from a fasta file if it is not built yet
+Sequence ids are parsed so hits keep their GenBank accession"""
+def makedb(database):
+    if any(os.path.exists(database + ext) for ext in (".nal", ".nsq", ".ndb")):
+        return database
+    print("Building local BLAST database from ", database, " with makeblastdb...")
+    execute(["makeblastdb", "-in", database, "-dbtype", "nucl", "-parse_seqids", "-out", database], log = "logs/blast.log")
+    return database
+
+"""Blasts fasta file against a local database with BLAST+
+Writes the same XML format as qblast (-outfmt 5)"""
+def local_blast(path, blastnum, resultnum, database, threads):
+    if database is None:
+        raise ValueError("Local BLAST backend requires a database fasta (--blast-db)")
+    execute(["blastn", "-task", "megablast", "-query", path, "-db", makedb(database), "-outfmt", "5",
+             "-max_target_seqs", blastnum, "-num_threads", threads,
+             "-out", "blast" + str(resultnum) + ".xml"], log = "logs/blast.log")
+
+"""Send a request to the BLAST URL API, waiting for a token first"""
+def blast_request(bucket, params):
+    params = dict(params)
+    params["tool"] = Blast.tool
+    if Blast.email:
+        params["email"] = Blast.email
+    bucket.acquire()
+    data = urllib.parse.urlencode(params).encode()
+    with urllib.request.urlopen(BLAST_URL, data=data) as response:
+        return response.read()
+
+"""Submit, poll and download one query
+Returns the number of the written blastN.xml"""
+def scheduled_blast(bucket, path, blastnum, resultnum):
+    blastseq = open(path).read()
+    """Submit query and read RID and estimated time from the QBlastInfo block"""
+    page = blast_request(bucket, {"CMD": "Put", "PROGRAM": "blastn", "DATABASE": "nt",
+                                  "QUERY": blastseq, "HITLIST_SIZE": blastnum}).decode()
+    rid = re.search(r"RID = (\S+)", page)
+    rtoe = re.search(r"RTOE = (\d+)", page)
+    if rid is None:
+        raise RuntimeError("BLAST submission failed for " + path)
+    rid = rid.group(1)
+    print("Submitted ", path, " as RID ", rid)
+    time.sleep(int(rtoe.group(1)) if rtoe else POLL_INTERVAL)
+
+    """Poll until the search is done"""
+    while True:
+        status = blast_request(bucket, {"CMD": "Get", "FORMAT_OBJECT": "SearchInfo", "RID": rid}).decode()
+        if "Status=READY" in status:
+            break
+        if "Status=FAILED" in status or "Status=UNKNOWN" in status:
+            raise RuntimeError("BLAST search " + rid + " for " + path + " failed or expired")
+        time.sleep(POLL_INTERVAL)
+
+    """Write results into xml"""
+    results = blast_request(bucket, {"CMD": "Get", "FORMAT_TYPE": "XML", "RID": rid,
+                                     "ALIGNMENTS": blastnum, "DESCRIPTIONS": blastnum})
+    with open("blast" + str(resultnum) + ".xml", "wb") as out_stream:
+        out_stream.write(results)
+    print("Finished RID ", rid, " -> blast", resultnum, ".xml")
+    return resultnum
+
 """Blasts fasta files to NCBI
-takes directory path instead"""
-def multi_blast(path, blastnum):
+takes directory path instead
+Queries are submitted and polled concurrently (all at once unless workers is set),
+requests share one token bucket"""
+def multi_blast(path, blastnum, workers = None, backend = "remote", database = None, threads = 1):
     blastseqs = [os.path.join(path, file) for file in os.listdir(path)]
-    blastloop = 1
-
-    """For each fasta in the directory"""
-    for fasta in blastseqs:
-        """Blast each fasta to NCBI"""
-        nuc_blast(fasta, blastnum, blastloop)
-        blastloop += 1
-        """Fit NCBI API guidelines"""
-        if fasta == blastseqs[-1]:
-            continue
-        else:
-            time.sleep(5)
+    """Local searches run one after another, each using all threads"""
+    if backend == "local":
+        for blastloop, fasta in enumerate(blastseqs, start = 1):
+            local_blast(fasta, blastnum, blastloop, database, threads)
+        return
+    bucket = TokenBucket(REQUEST_RATE)
+
+    """blastN.xml numbering follows directory order like the parser expects"""
+    with ThreadPoolExecutor(max_workers = workers or len(blastseqs) or 1) as pool:
+        jobs = [pool.submit(scheduled_blast, bucket, fasta, blastnum, blastloop)
+                for blastloop, fasta in enumerate(blastseqs, start = 1)]
+        for job in jobs:
+            job.result()
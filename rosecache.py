@@ -0,0 +1,149 @@
+"""GenBank Record Cache for Rosetree
+Keeps fetched GBSeq xml on disk so reruns on overlapping samples skip Entrez.
+Developed by: Fletcher Falk"""
+import os, time, sqlite3, hashlib, zlib
+from rosefasta import iterrecords, recordname
+
+"""Persistent SQLite cache of GBSeq xml
+Records are keyed by accession.version and point to a compressed blob addressed by its sha256,
+so identical records fetched under different keys are only stored once.
+Records of a window of a sequence (seq_start/seq_stop) carry the window in their key as accession.version:start-stop"""
+class RecordCache:
+    def __init__(self, cachedir, ttl = 30, maxsize = 1024):
+        os.makedirs(cachedir, exist_ok=True)
+        self.path = os.path.join(cachedir, "genbank.sqlite")
+        """Time to live in days and size bound in MB"""
+        self.ttl = float(ttl) * 86400
+        self.maxsize = float(maxsize) * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, data BLOB, size INTEGER);
+            CREATE TABLE IF NOT EXISTS records (key TEXT PRIMARY KEY, accession TEXT, digest TEXT, fetched REAL, used REAL);
+            CREATE INDEX IF NOT EXISTS records_accession ON records (accession);
+        """)
+        self.evict()
+
+    """Return cached xml for an accession (with or without version) or None
+    region is the (start, stop) window for partial records"""
+    def get(self, accession, region = None):
+        if region:
+            accession += ":%d-%d" % tuple(region)
+        row = self.db.execute("SELECT records.key, blobs.data FROM records JOIN blobs ON records.digest = blobs.digest "
+                              "WHERE (records.key = ? OR records.accession = ?) AND records.fetched > ? "
+                              "ORDER BY records.fetched DESC LIMIT 1", (accession, accession, time.time() - self.ttl)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.execute("UPDATE records SET used = ? WHERE key = ?", (time.time(), row[0]))
+        return zlib.decompress(row[1])
+
+    """Store xml for an accession.version"""
+    def put(self, accessionversion, xml, region = None):
+        key = accessionversion
+        accession = accessionversion.split(".")[0]
+        if region:
+            key += ":%d-%d" % tuple(region)
+            accession += ":%d-%d" % tuple(region)
+        digest = hashlib.sha256(xml).hexdigest()
+        data = zlib.compress(xml)
+        now = time.time()
+        self.db.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)", (digest, data, len(data)))
+        self.db.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)",
+                        (key, accession, digest, now, now))
+        self.db.commit()
+
+    """Drop expired records, then least recently used records until under the size bound"""
+    def evict(self):
+        self.db.execute("DELETE FROM records WHERE fetched <= ?", (time.time() - self.ttl,))
+        self.db.execute("DELETE FROM blobs WHERE digest NOT IN (SELECT digest FROM records)")
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total > self.maxsize:
+            for key, digest, size in self.db.execute("SELECT records.key, records.digest, blobs.size FROM records "
+                                                     "JOIN blobs ON records.digest = blobs.digest ORDER BY records.used").fetchall():
+                if total <= self.maxsize:
+                    break
+                self.db.execute("DELETE FROM records WHERE key = ?", (key,))
+                if self.db.execute("SELECT COUNT(*) FROM records WHERE digest = ?", (digest,)).fetchone()[0] == 0:
+                    self.db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                    total -= size
+        self.db.commit()
+
+    """Write changes, evict and close"""
+    def close(self):
+        self.evict()
+        self.db.close()
+
+    """Hit and miss counters for the end of the run"""
+    def report(self):
+        print("GenBank cache: ", self.hits, " hits, ", self.misses, " misses (", self.path, ")")
+
+"""Persistent cache of ModelTest-NG selections
+Keyed by the sha256 of the trimmed alignment together with the candidate model options.
+An alignment that differs from a cached one by only a few taxa reuses its model: same options,
+at least NEAR_TAXA shared taxa (Jaccard) and a column count within NEAR_COLUMNS"""
+class ModelCache:
+    NEAR_TAXA = 0.9
+    NEAR_COLUMNS = 0.05
+
+    def __init__(self, cachedir):
+        os.makedirs(cachedir, exist_ok=True)
+        self.path = os.path.join(cachedir, "models.sqlite")
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS models (key TEXT PRIMARY KEY, model TEXT, created REAL);
+            CREATE TABLE IF NOT EXISTS fingerprints (key TEXT PRIMARY KEY, options TEXT, columns INTEGER, taxa TEXT);
+            CREATE INDEX IF NOT EXISTS fingerprints_options ON fingerprints (options);
+        """)
+        """Options, taxa and column count of the alignments keyed in this session"""
+        self.fingerprints = {}
+
+    """Key for an alignment file and the modeltest-ng candidate options"""
+    def key(self, alignment, options):
+        digest = hashlib.sha256()
+        with open(alignment, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        options = " ".join(str(option) for option in options)
+        key = digest.hexdigest() + ":" + options
+        taxa = []
+        columns = 0
+        for title, sequence in iterrecords(alignment):
+            taxa.append(recordname(title))
+            columns = max(columns, len(sequence))
+        self.fingerprints[key] = (options, columns, frozenset(taxa))
+        return key
+
+    """Selected model for a key or None, falling back to a near match of the alignment"""
+    def get(self, key):
+        row = self.db.execute("SELECT model FROM models WHERE key = ?", (key,)).fetchone()
+        if row:
+            return row[0]
+        if key not in self.fingerprints:
+            return None
+        options, columns, taxa = self.fingerprints[key]
+        best = None
+        for model, cachedcolumns, cachedtaxa in self.db.execute("SELECT models.model, fingerprints.columns, fingerprints.taxa FROM fingerprints "
+                                                                "JOIN models ON models.key = fingerprints.key WHERE fingerprints.options = ?", (options,)):
+            if abs(cachedcolumns - columns) > self.NEAR_COLUMNS * max(columns, 1):
+                continue
+            cachedtaxa = set(cachedtaxa.split("\n"))
+            shared = len(taxa & cachedtaxa) / max(len(taxa | cachedtaxa), 1)
+            if shared >= self.NEAR_TAXA and (best is None or shared > best[0]):
+                best = (shared, model)
+        if best is None:
+            return None
+        print("Reusing the model of a cached alignment sharing ", round(100 * best[0], 1), "% of taxa")
+        return best[1]
+
+    def put(self, key, model):
+        self.db.execute("INSERT OR REPLACE INTO models VALUES (?, ?, ?)", (key, model, time.time()))
+        if key in self.fingerprints:
+            options, columns, taxa = self.fingerprints[key]
+            self.db.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)", (key, options, columns, "\n".join(sorted(taxa))))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
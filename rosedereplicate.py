@@ -0,0 +1,81 @@
+"""Sequence dereplication for Rosetree
+Clusters near identical sequences with k-mer sketches and keeps one representative per cluster before alignment.
+Developed by: Fletcher Falk"""
+import os, math, zlib
+from rosefasta import readfasta, recordname
+
+"""k-mer length and number of hashes kept per sketch (bottom-k MinHash)"""
+KMER = 16
+SKETCH = 256
+
+"""Bottom-k sketch of the k-mers in a sequence"""
+def sketch(sequence):
+    data = sequence.encode()
+    hashes = {zlib.crc32(data[i:i + KMER]) for i in range(len(data) - KMER + 1)}
+    return frozenset(sorted(hashes)[:SKETCH])
+
+"""Estimated identity between two sketches from the Mash distance"""
+def identity(first, second):
+    merged = sorted(first | second)[:SKETCH]
+    if not merged:
+        return 0.0
+    shared = sum(1 for value in merged if value in first and value in second)
+    jaccard = shared / len(merged)
+    if jaccard == 0:
+        return 0.0
+    return 1 + math.log(2 * jaccard / (1 + jaccard)) / KMER
+
+"""Greedy clustering at an identity threshold
+Protected records (input samples and outgroup) always stay as representatives,
+the rest are visited longest first and join the first representative close enough"""
+def dereplicate(fastafile, outputfasta, clustermap, threshold, protected = ()):
+    records = [(title, sequence.upper()) for title, sequence in readfasta(fastafile)]
+    protected = set(protected)
+    order = sorted(range(len(records)), key = lambda i: (recordname(records[i][0]) not in protected, -len(records[i][1])))
+    representatives = []
+    exact = {}
+    clusters = {}
+    for i in order:
+        title, sequence = records[i]
+        name = recordname(title)
+        member = None
+        current = None
+        if name not in protected:
+            """Identical sequences are matched without sketching"""
+            member = exact.get(sequence)
+            if member is None:
+                current = sketch(sequence)
+                for representative, repsketch in representatives:
+                    if identity(current, repsketch) >= threshold:
+                        member = representative
+                        break
+        if member is None:
+            representatives.append((name, current or sketch(sequence)))
+            exact.setdefault(sequence, name)
+            clusters[name] = [i]
+        else:
+            clusters[member].append(i)
+
+    """Representatives (first member of each cluster) are written in their original order"""
+    with open(outputfasta, "w") as output, open(clustermap, "w") as mapping:
+        mapping.write("representative\tmember\n")
+        for name, members in sorted(clusters.items(), key = lambda item: item[1][0]):
+            title, sequence = records[members[0]]
+            output.write(title + "\n" + sequence + "\n")
+            for member in members:
+                mapping.write(name + "\t" + recordname(records[member][0]) + "\n")
+    print("Dereplicated ", len(records), " sequences into ", len(clusters), " clusters at ", threshold, " identity")
+    return len(clusters)
+
+"""Read a cluster map into representative to list of collapsed members"""
+def readclustermap(clustermap = "clustermap.tsv"):
+    collapsed = {}
+    if not os.path.isfile(clustermap):
+        return collapsed
+    with open(clustermap, "r") as mapping:
+        next(mapping, None)
+        for line in mapping:
+            representative, member = line.rstrip("\n").split("\t")
+            if member != representative:
+                collapsed.setdefault(representative, []).append(member)
+    return collapsed
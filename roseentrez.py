@@ -0,0 +1,238 @@
+"""Entrez client for Rosetree
+Sends E-utilities requests in batches of accessions instead of one request per accession.
+Developed by: Fletcher Falk"""
+import io, re, time, random, threading, http.client, urllib.error, urllib.parse, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree as ET
+from rosethrottle import TokenBucket
+from rosemetastore import SOURCE_FIELDS
+from rosemarkers import featurequals
+
+"""Base url for E-utilities
+Can be pointed at a local HTTP stand-in for testing (e.g. http://127.0.0.1:8000/)"""
+EUTILS = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+
+"""Retries on 429/5xx and connection errors, backing off exponentially from BACKOFF seconds"""
+RETRIES = 5
+BACKOFF = 1
+
+"""Seconds a request may stall (connect or read) before it is retried"""
+TIMEOUT = 60
+
+"""Shared rate limiter, NCBI allows 3 requests per second or 10 with an API key"""
+bucket = TokenBucket(3)
+
+"""Tool name, contact email and API key sent with every request"""
+identity = {"tool": "rosetree", "email": None, "api_key": None}
+
+"""Latency and retry counts of every request for the end of run report"""
+class RequestStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+
+    def record(self, cgi, latency, retries):
+        with self.lock:
+            self.requests.append((cgi, latency, retries))
+
+    def report(self):
+        if not self.requests:
+            print("Entrez: no requests made")
+            return
+        latencies = sorted(latency for cgi, latency, retries in self.requests)
+        print("Entrez: ", len(latencies), " requests, ", sum(retries for cgi, latency, retries in self.requests), " retries, ",
+              "latency mean %.2fs median %.2fs max %.2fs" % (sum(latencies) / len(latencies), latencies[len(latencies) // 2], latencies[-1]))
+
+stats = RequestStats()
+
+"""Set the contact email, API key and matching request rate"""
+def setup(api_key = None, email = None):
+    global bucket
+    identity.update(email = email, api_key = api_key)
+    bucket = TokenBucket(10 if api_key else 3)
+
+"""Send a request to an E-utility and return the raw response"""
+def request(cgi, params):
+    params = dict(params, tool = identity["tool"])
+    if identity["email"]:
+        params["email"] = identity["email"]
+    if identity["api_key"]:
+        params["api_key"] = identity["api_key"]
+    """POST so long comma joined id lists are not cut off in the url"""
+    data = urllib.parse.urlencode(params).encode()
+    start = time.monotonic()
+    for attempt in range(RETRIES + 1):
+        bucket.acquire()
+        try:
+            with urllib.request.urlopen(EUTILS + cgi, data=data, timeout=TIMEOUT) as response:
+                result = response.read()
+            stats.record(cgi, time.monotonic() - start, attempt)
+            return result
+        except urllib.error.HTTPError as error:
+            if attempt == RETRIES or (error.code != 429 and error.code < 500):
+                raise
+            print("Entrez returned ", error.code, ", retrying ", cgi, "...")
+        except (OSError, http.client.HTTPException) as error:
+            """Connection errors, resets, dropped or cut off responses and timeouts"""
+            if attempt == RETRIES:
+                raise
+            print("Entrez connection failed (", getattr(error, "reason", None) or repr(error), "), retrying ", cgi, "...")
+        time.sleep(BACKOFF * 2 ** attempt + random.uniform(0, BACKOFF))
+
+"""Post accessions to the history server, returns WebEnv and query key"""
+def epost(accessions):
+    result = ET.fromstring(request("epost.fcgi", {"db": "nucleotide", "id": ",".join(accessions)}))
+    if result.findtext("WebEnv") is None:
+        raise RuntimeError("Entrez epost failed: " + str(result.findtext(".//ERROR")))
+    return result.findtext("WebEnv"), result.findtext("QueryKey")
+
+"""Fetch GenBank xml for accessions in batches
+Batches are requested by a bounded worker pool sharing the rate limiter
+Yields the raw GBSet xml of each batch in the order of the accessions"""
+def efetch(accessions, batchsize=200, workers=3):
+    accessions = list(accessions)
+    params = {"db": "nucleotide", "rettype": "gb", "retmode": "xml"}
+    """Big lists go through epost/WebEnv history instead of long id lists"""
+    if len(accessions) > batchsize:
+        webenv, querykey = epost(accessions)
+        params.update({"WebEnv": webenv, "query_key": querykey, "retmax": batchsize})
+    batches = []
+    for start in range(0, len(accessions), batchsize):
+        if "WebEnv" in params:
+            batches.append(dict(params, retstart = start))
+        else:
+            batches.append(dict(params, id = ",".join(accessions[start:start + batchsize])))
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        """map hands results back in submission order"""
+        yield from pool.map(lambda batch: request("efetch.fcgi", batch), batches)
+
+"""Fetch a window of each accession with seq_start/seq_stop
+Entrez applies seq_start/seq_stop to every id of a request so each window is its own request,
+the returned record only holds the sequence and features inside the window.
+regions is a list of (accession, (start, stop)), results come back in the same order"""
+def efetchregions(regions, workers=3):
+    def fetch(region):
+        accession, (start, stop) = region
+        return request("efetch.fcgi", {"db": "nucleotide", "rettype": "gb", "retmode": "xml", "id": accession,
+                                       "seq_start": start, "seq_stop": stop})
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        yield from pool.map(fetch, regions)
+
+"""Header so single GBSeq records can be read by Entrez again"""
+GBSET = b'<?xml version="1.0" encoding="UTF-8" ?>\n<!DOCTYPE GBSet PUBLIC "-//NCBI//NCBI GBSeq/EN" "https://www.ncbi.nlm.nih.gov/dtd/NCBI_GBSeq.dtd">\n'
+
+"""Split a GBSeq set into the xml of each record
+Records are cut out of the returned bytes without parsing them"""
+def splitrecords(batch):
+    start = batch.find(b"<GBSeq>")
+    while start != -1:
+        end = batch.index(b"</GBSeq>", start) + len(b"</GBSeq>")
+        xml = batch[start:end]
+        accession = re.search(rb"<GBSeq_accession-version>([^<]*)<", xml) or re.search(rb"<GBSeq_primary-accession>([^<]*)<", xml)
+        yield accession.group(1).decode(), xml
+        start = batch.find(b"<GBSeq>", end)
+
+"""Parse the xml of a single GBSeq record, only full records (fields=None) need Biopython"""
+def parserecord(xml):
+    from Bio import Entrez
+    return Entrez.read(io.BytesIO(GBSET + b"<GBSet>" + xml + b"</GBSet>"))[0]
+
+"""Record fields kept by the projection, everything else is dropped while streaming"""
+RECORD_FIELDS = ("GBSeq_length", "GBSeq_primary-accession", "GBSeq_accession-version", "GBSeq_organism", "GBSeq_definition", "GBSeq_sequence")
+
+"""Qualifiers kept for features other than source (default 16S marker extraction)"""
+FEATURE_QUALS = featurequals(("16S",))
+
+"""GBSeq_sequence of longer records (whole genomes) is not kept, windows and single genes are"""
+MAXSEQUENCE = 100000
+
+"""Complete genomes and chromosomes, their sequence is taken from a feature instead of GBSeq_sequence"""
+def isgenome(definition):
+    return "complete genome" in definition or "chromosome" in definition
+
+"""Stream a GBSeq record keeping only the projected fields
+Returns the same dict layout as Entrez.read for the kept parts: the record fields, references with their number and authors,
+source features with the requested qualifiers and the features in FEATURE_QUALS.
+Elements are cleared as soon as they are read so genome sized records never build a full tree,
+GBSeq_sequence is dropped for records longer than maxsequence (None keeps every sequence)"""
+def projectrecord(xml, fields = SOURCE_FIELDS, featurequals = FEATURE_QUALS, maxsequence = MAXSEQUENCE):
+    quals = dict(featurequals, source = tuple(fields))
+    record = {"GBSeq_references": [], "GBSeq_feature-table": []}
+    feature = None
+    depth = 0
+    for event, element in ET.iterparse(io.BytesIO(xml), events = ("start", "end")):
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        tag = element.tag
+        if tag == "GBFeature_key":
+            feature = {"GBFeature_key": element.text, "GBFeature_intervals": [], "GBFeature_quals": []} if element.text in quals else None
+        elif feature is not None and tag == "GBFeature_location":
+            feature["GBFeature_location"] = element.text
+        elif feature is not None and tag == "GBInterval":
+            feature["GBFeature_intervals"].append({child.tag: child.text for child in element})
+            element.clear()
+        elif tag == "GBQualifier":
+            name = element.findtext("GBQualifier_name")
+            if feature is not None and name in quals[feature["GBFeature_key"]]:
+                qualifier = {"GBQualifier_name": name}
+                if element.find("GBQualifier_value") is not None:
+                    qualifier["GBQualifier_value"] = element.findtext("GBQualifier_value")
+                feature["GBFeature_quals"].append(qualifier)
+            element.clear()
+        elif tag == "GBFeature":
+            if feature is not None:
+                record["GBSeq_feature-table"].append(feature)
+            feature = None
+            element.clear()
+        elif tag == "GBReference":
+            reference = {"GBReference_reference": element.findtext("GBReference_reference")}
+            if element.find("GBReference_authors") is not None:
+                reference["GBReference_authors"] = [author.text for author in element.iter("GBAuthor")]
+            record["GBSeq_references"].append(reference)
+            element.clear()
+        elif depth == 1:
+            """Direct children of GBSeq"""
+            if tag in RECORD_FIELDS and not (tag == "GBSeq_sequence" and maxsequence is not None and int(record.get("GBSeq_length") or 0) > maxsequence):
+                record[tag] = element.text
+            element.clear()
+    return record
+
+"""Fetch and parse records for accessions
+Records found in the cache are not requested from Entrez
+Records are projected onto the given source qualifiers (see projectrecord), fields=None parses full records with Entrez.read
+Accessions in regions (accession to (start, stop)) are fetched as that window only, for hits on genomes
+featurequals are the features kept for marker extraction (see rosemarkers.featurequals)
+maxsequence is the longest record whose sequence is kept (None keeps all, for markers sliced out of whole genomes)
+Returns a dictionary of accession to its GBSeq record"""
+def fetchrecords(accessions, batchsize=200, cache=None, workers=3, fields=SOURCE_FIELDS, regions=None, featurequals=FEATURE_QUALS,
+                 maxsequence=MAXSEQUENCE):
+    def parse(xml):
+        return parserecord(xml) if fields is None else projectrecord(xml, fields, featurequals, maxsequence)
+    regions = regions or {}
+    records = {}
+    missing = []
+    missingregions = []
+    for accession in accessions:
+        xml = cache.get(accession, regions.get(accession)) if cache else None
+        if xml is not None:
+            records[accession] = parse(xml)
+        elif accession in regions:
+            missingregions.append((accession, regions[accession]))
+        else:
+            missing.append(accession)
+    for (accession, region), batch in zip(missingregions, efetchregions(missingregions, workers)):
+        for accessionversion, xml in splitrecords(batch):
+            if cache:
+                cache.put(accessionversion, xml, region)
+            records[accession] = parse(xml)
+    for batch in efetch(missing, batchsize, workers):
+        """Split the returned GBSeq set back into per accession records"""
+        for accessionversion, xml in splitrecords(batch):
+            if cache:
+                cache.put(accessionversion, xml)
+            record = parse(xml)
+            records[record['GBSeq_primary-accession']] = record
+            records[accessionversion.split(".")[0]] = record
+    return records
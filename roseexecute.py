@@ -0,0 +1,81 @@
+"""External command execution for Rosetree
+Runs tools from an argv list and streams their output line by line to the console and a log file.
+Developed by: Fletcher Falk"""
+import os, sys, time, signal, subprocess, threading
+from roseprofile import profiler
+
+"""Seconds to wait after SIGTERM before the process group is killed"""
+KILL_GRACE = 5
+
+"""Stop a command and every process it started"""
+def killgroup(process):
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            return
+        deadline = time.monotonic() + KILL_GRACE
+        while time.monotonic() < deadline:
+            if os.waitpid(process.pid, os.WNOHANG)[0] != 0:
+                return
+            time.sleep(0.1)
+
+"""Copy a stream line by line into each sink as it arrives"""
+def pump(stream, sinks):
+    for line in iter(stream.readline, b""):
+        for sink in sinks:
+            sink(line)
+    stream.close()
+
+"""Execute a command
+argv is passed without a shell, stdout can be sent to a file instead of the console (replaces > redirection),
+timeout is in seconds for the whole command, Ctrl-C or a timeout kills the whole process group"""
+def execute(argv, log = None, stdout = None, timeout = None):
+    argv = [str(arg) for arg in argv]
+    print("Running: ", " ".join(argv))
+    logfile = None
+    if log:
+        os.makedirs(os.path.dirname(log) or ".", exist_ok=True)
+        logfile = open(log, "ab")
+    outfile = open(stdout, "wb") if stdout else None
+
+    def console(line):
+        sys.stdout.write(line.decode(errors="replace"))
+        sys.stdout.flush()
+    errsinks = [console] + ([logfile.write] if logfile else [])
+    outsinks = [outfile.write] if outfile else errsinks
+
+    with profiler.command(" ".join(argv)) as record:
+        """New session so the tool and its children share a process group"""
+        process = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+        pumps = [threading.Thread(target=pump, args=(process.stdout, outsinks), daemon=True),
+                 threading.Thread(target=pump, args=(process.stderr, errsinks), daemon=True)]
+        for thread in pumps:
+            thread.start()
+        deadline = time.monotonic() + float(timeout) if timeout else None
+        try:
+            """wait4 gives the resource usage of this command alone"""
+            while True:
+                pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+                if pid != 0:
+                    break
+                if deadline and time.monotonic() > deadline:
+                    killgroup(process)
+                    raise subprocess.TimeoutExpired(argv, timeout)
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            print("Cancelled, stopping ", argv[0], "...")
+            killgroup(process)
+            raise
+        finally:
+            for thread in pumps:
+                thread.join(timeout=KILL_GRACE)
+            if outfile:
+                outfile.close()
+            if logfile:
+                logfile.close()
+        process.returncode = os.waitstatus_to_exitcode(status)
+        record["peak_rss_mb"] = round(usage.ru_maxrss / 1024, 1)
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, argv)
@@ -0,0 +1,116 @@
+"""FASTA reader and writer for Rosetree
+Reads files through memory mapping and handles wrapped multi-line records.
+Alignments are kept as NumPy byte arrays for column statistics.
+Developed by: Fletcher Falk"""
+import mmap
+from contextlib import contextmanager
+import numpy as np
+
+"""Memory map a file read only, empty files give empty bytes"""
+@contextmanager
+def mapped(path):
+    with open(path, "rb") as file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            yield b""
+            return
+        try:
+            yield data
+        finally:
+            data.close()
+
+"""Byte offsets where records start ('>' at the start of a line)"""
+def recordstarts(data):
+    starts = []
+    position = 0 if data[:1] == b">" else data.find(b"\n>")
+    while position != -1:
+        if data[position:position + 1] == b"\n":
+            position += 1
+        starts.append(position)
+        position = data.find(b"\n>", position)
+    return starts
+
+"""Yield (title line, sequence) for each record, wrapped sequence lines are joined"""
+def iterrecords(path):
+    with mapped(path) as data:
+        starts = recordstarts(data)
+        for number, start in enumerate(starts):
+            end = starts[number + 1] if number + 1 < len(starts) else len(data)
+            newline = data.find(b"\n", start, end)
+            if newline == -1:
+                newline = end
+            title = data[start:newline].decode().rstrip("\r")
+            sequence = data[newline:end].translate(None, b"\r\n\t ").decode()
+            yield title, sequence
+
+"""All records of a fasta file"""
+def readfasta(path):
+    return list(iterrecords(path))
+
+"""First record of a fasta file"""
+def readfirst(path):
+    return next(iterrecords(path), (None, None))
+
+"""Name of a record as it appears on the tree"""
+def recordname(title):
+    return title[1:].split(" ")[0]
+
+"""Count records without decoding the file"""
+def countrecords(path):
+    with mapped(path) as data:
+        if not data:
+            return 0
+        array = np.frombuffer(data, dtype=np.uint8)
+        starts = array == ord(">")
+        starts[1:] &= array[:-1] == ord("\n")
+        count = int(starts.sum())
+        del array, starts
+        return count
+
+"""Number of records and longest sequence, measured on the mapped bytes"""
+def fastadimensions(path):
+    longest = 0
+    with mapped(path) as data:
+        starts = recordstarts(data)
+        for number, start in enumerate(starts):
+            end = starts[number + 1] if number + 1 < len(starts) else len(data)
+            newline = data.find(b"\n", start, end)
+            if newline != -1:
+                longest = max(longest, len(data[newline:end].translate(None, b"\r\n\t ")))
+    return len(starts), longest
+
+"""Write one record with the sequence on a single line"""
+def writerecord(file, title, sequence):
+    file.write(title + "\n" + sequence + "\n")
+
+"""Write records to a fasta file"""
+def writerecords(path, records, mode = "w"):
+    with open(path, mode) as fasta:
+        for title, sequence in records:
+            writerecord(fasta, title, sequence)
+
+"""Alignment as record names and a (taxa x columns) uint8 array"""
+def alignmentarray(path):
+    names = []
+    rows = []
+    for title, sequence in iterrecords(path):
+        names.append(recordname(title))
+        rows.append(sequence.upper().encode())
+    width = max((len(row) for row in rows), default=0)
+    array = np.full((len(rows), width), ord("-"), dtype=np.uint8)
+    for number, row in enumerate(rows):
+        array[number, :len(row)] = np.frombuffer(row, dtype=np.uint8)
+    return names, array
+
+"""Column statistics of an alignment array
+gap fraction per column, constant columns and parsimony informative columns"""
+def columnstats(array):
+    taxa, columns = array.shape
+    gaps = (array == ord("-")) | (array == ord("N")) | (array == ord("?"))
+    counts = np.stack([(array == ord(base)).sum(axis=0) for base in "ACGT"])
+    informative = (counts >= 2).sum(axis=0) >= 2
+    constant = (counts > 0).sum(axis=0) <= 1
+    return {"taxa": taxa, "columns": columns,
+            "gap_fraction": float(gaps.mean()) if array.size else 0.0,
+            "constant": int(constant.sum()), "informative": int(informative.sum())}
@@ -0,0 +1,88 @@
+"""Leaf labels for Rosetree renders
+Metadata index, genus colors and per leaf label text shared by the ETE and SVG/PDF backends.
+Does not import ete3 so headless renders do not need Qt.
+Developed by: Fletcher Falk"""
+import re
+from rosedereplicate import readclustermap
+from rosemetastore import genera, records, genuscolor
+
+"""Style options a rerender can change without rebuilding the labels"""
+STYLE = {"show_leaf_name": True, "show_branch_length": True, "support_cutoff": 60, "support_size": 7, "support_color": "red",
+         "label_size": 11, "sample_color": "#F7879A", "sample_text": "white", "column_size": 10}
+
+"""Genus color generate
+Calm/lighter tone color for legibility, the same genus always gets the same color"""
+def graphcolor(colortotal):
+    return [genuscolor(genus) for genus in colortotal]
+
+"""Species list and color"""
+def specieslist():
+    """Unique genus from the metadata store to generate colors for"""
+    cleanlist = genera()
+    colors = graphcolor(cleanlist)
+    """Return list and color for each genus"""
+    return colors, cleanlist
+
+"""Index metadata by accession once per render
+Each record holds the organism, its precomputed genus color and the requested source columns only"""
+def metadataindex(colors, cleanlist, columns = ()):
+    genuscolors = dict(zip(cleanlist, colors))
+    index = records(columns)
+    for record in index.values():
+        record["color"] = genuscolors[record["genus"]]
+    return index
+
+"""Node text face fixer"""
+def textfacefix(inputlabel):
+    """If input is longer than 25 characters add newline to format better"""
+    max_length = 25
+    finalabel = ""
+    """When inputlabel is greater than 25 split and reformat"""
+    while len(inputlabel) > max_length:
+        whitespace = re.search(r"\s", inputlabel[max_length:])
+        """If whitespace is found find split point otherwise use string"""
+        if whitespace:
+            split = max_length + whitespace.start()
+        else:
+            split = len(inputlabel)
+        """Remove whitespace and add newline"""
+        finalabel += inputlabel[:split].strip() + "\n"
+        inputlabel = inputlabel[split:].strip()
+    finalabel += inputlabel
+    return finalabel
+
+"""Labels for every leaf computed once per session
+Samples are numbered in leaf order so the numbering does not depend on how often a backend draws them"""
+def leaflabels(leafnames, index, inputblast, collapsed, columns):
+    labels = {}
+    samplenum = 1
+    for name in leafnames:
+        label = {"sample": None, "collapsed": len(collapsed.get(name, [])), "organism": None, "color": None, "columns": []}
+        """Check if node is one of the input fasta files"""
+        if name in inputblast:
+            label["sample"] = samplenum
+            samplenum += 1
+        record = index.get(name)
+        if record:
+            label["organism"] = record["organism"]
+            label["color"] = record["color"]
+            label["columns"] = [textfacefix(str(record["source"].get(column))) for column in columns]
+        labels[name] = label
+    return labels
+
+"""Metadata index and labels for the leaves of a tree"""
+def loadlabels(leafnames, inputblast, columns = ()):
+    """Construct variables from the metadata store"""
+    colors, cleanlist = specieslist()
+    index = metadataindex(colors, cleanlist, columns)
+    """Cluster map from dereplication, empty when it was not used"""
+    collapsed = readclustermap()
+    return index, leaflabels(leafnames, index, inputblast, collapsed, columns)
+
+"""Render function of a backend, imported on use so the svg backend never loads ete3/Qt"""
+def renderer(backend = "ete"):
+    if backend == "svg":
+        from rosesvg import phylogeny
+    else:
+        from rosephylogeny import phylogeny
+    return phylogeny
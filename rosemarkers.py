@@ -0,0 +1,72 @@
+"""Marker genes for Rosetree
+Registry of loci that can be pulled out of GenBank records (16S, ITS, rpoB, gyrB).
+A marker is found by feature key and gene or product name, its sequence is the transcription
+qualifier when NCBI provides one, otherwise it is sliced from the record sequence by the feature intervals.
+Developed by: Fletcher Falk"""
+import re
+from collections import namedtuple
+
+"""Feature keys to look in, gene names (case insensitive) and a product pattern"""
+Marker = namedtuple("Marker", ["name", "keys", "genes", "products"])
+
+MARKERS = {
+    "16S": Marker("16S", ("rRNA",), ("rrs",), re.compile(r"16S ribosomal RNA", re.I)),
+    "ITS": Marker("ITS", ("misc_RNA",), (), re.compile(r"internal transcribed spacer|\bITS[12]?\b", re.I)),
+    "rpoB": Marker("rpoB", ("gene", "CDS"), ("rpob",), re.compile(r"RNA polymerase subunit beta$", re.I)),
+    "gyrB": Marker("gyrB", ("gene", "CDS"), ("gyrb",), re.compile(r"gyrase subunit B$", re.I)),
+}
+
+"""Qualifiers needed to match and extract a marker"""
+QUALS = ("gene", "product", "transcription")
+
+"""Complement table for minus strand features"""
+COMPLEMENT = str.maketrans("ACGTUNacgtun", "TGCAANtgcaan")
+
+"""Features and qualifiers the Entrez projection has to keep for these markers"""
+def featurequals(markers):
+    return {key: QUALS for marker in markers for key in MARKERS[marker].keys}
+
+"""Feature sequence from its intervals, None when the record sequence was not kept or the feature spans other records"""
+def slicefeature(feature, record):
+    sequence = record.get("GBSeq_sequence")
+    if not sequence or not feature.get("GBFeature_intervals"):
+        return None
+    version = record.get("GBSeq_accession-version")
+    parts = []
+    for interval in feature["GBFeature_intervals"]:
+        if "GBInterval_from" not in interval or interval.get("GBInterval_accession", version) != version:
+            return None
+        start, stop = int(interval["GBInterval_from"]), int(interval["GBInterval_to"])
+        if start <= stop:
+            parts.append(sequence[start - 1:stop])
+        else:
+            parts.append(sequence[stop - 1:start][::-1].translate(COMPLEMENT))
+    return "".join(parts)
+
+"""Extract markers from fetched records in one pass over their feature tables
+Returns accession to {marker: sequence} with only the markers that were found"""
+def extract(records, accessions, markers = ("16S",)):
+    markers = [MARKERS[marker] for marker in markers]
+    keys = {key for marker in markers for key in marker.keys}
+    found = {}
+    for accession in accessions:
+        record = records.get(accession)
+        if record is None:
+            continue
+        sequences = found.setdefault(accession, {})
+        for feature in record.get("GBSeq_feature-table", []):
+            if feature["GBFeature_key"] not in keys:
+                continue
+            quals = {}
+            for qual in feature["GBFeature_quals"]:
+                quals.setdefault(qual["GBQualifier_name"], qual.get("GBQualifier_value", ""))
+            for marker in markers:
+                if marker.name in sequences or feature["GBFeature_key"] not in marker.keys:
+                    continue
+                if quals.get("gene", "").lower() in marker.genes or marker.products.search(quals.get("product", "")):
+                    sequence = quals.get("transcription") or slicefeature(feature, record)
+                    if sequence:
+                        sequences[marker.name] = sequence
+            if len(sequences) == len(markers):
+                break
+    return found
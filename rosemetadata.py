@@ -1,90 +1,85 @@
 """Metadata Parser for Rosetree
 Uses Entrez to pull associated data for each accession number from BLAST.
 Developed by: Fletcher Falk"""
-import Bio, time
-from Bio import Entrez
-from xml.etree import ElementTree as ET
+import os
+from roseentrez import fetchrecords, isgenome
+from rosemarkers import extract, featurequals
+from rosemetastore import SOURCE_FIELDS, checkfields, writestore, exportxml
+from rosefasta import writerecords
 
-"""Entrez formatting 16S from complete genome sequence"""
-def parse16S(metadata, accession):
-    good16s = False
-    sequence = ""
-    """Look through feature table until 16S rRNA is found"""
-    for feature in metadata[0]['GBSeq_feature-table']:
-        if sequence != "":
-            break
-        if feature['GBFeature_key'] == 'rRNA':
-            for qual in feature['GBFeature_quals']:
-                if qual['GBQualifier_name'] == "product" and "16S ribosomal RNA" in qual['GBQualifier_value']:
-                    good16s = True
-                elif qual['GBQualifier_name'] == "transcription" and good16s == True:
-                    sequence = qual['GBQualifier_value']
-                    break
-    if sequence == "":
-        print("Unable to grab sequence from complete genome ", accession, " Likely unannotated.. excluding") 
-        return "Error"
-    return sequence
-
-"""Entrez Metadata Function"""
-def metaparser(accessionlist, inputblast):
+"""Entrez Metadata Function
+fields are the source qualifiers kept from each record (--metadata), records are only parsed as far as needed for them
+regions maps hits on genomes to the (start, stop) window around their HSP, only that window is fetched
+marker is the locus taken from genomes (see rosemarkers.MARKERS)
+extras are further markers for supermatrix mode, each written to markers/<marker>.fasta
+They lie outside the HSP window of genome hits, so with extras whole records are fetched and their sequences kept"""
+def metaparser(accessionlist, inputblast, batchsize = 200, cache = None, workers = 3, fields = SOURCE_FIELDS, regions = None, marker = "16S",
+               extras = ()):
     print("Fetching metadata with Entrez from BLAST results...", "\n")
+    """Qualifier columns are checked before any request is made"""
+    fields = checkfields(fields)
 
-    """Start writing new xml output for metadata by building ElementTree"""
-    root = ET.Element("MetadataOutput")
-    ET.SubElement(root, "Info",).text = "Rosetree metadata from blast of " + inputblast
-    ET.SubElement(root, "Dev",).text = "Part of program made by Fletcher Falk"
+    """Metadata entries for the store, blastmetadata.xml is exported from it"""
+    entries = []
     """For sequence number"""
     count = 1
 
-    """Go through each accession from the input list.
-    Setup like this to allow for sleep at end of loop to follow NCBI Guidelines
-    and prevent overloading requests of all the list at once."""
-    for accession in accessionlist:
-        """Fetch with Entrez"""
-        fetch = Entrez.efetch(db = "nucleotide", id = accession, rettype = "gb", retmode = "xml")
-        metadata = Entrez.read(fetch)
-        fetch.close()
+    """Fetch with Entrez in batches of accessions
+    Batches are fetched in parallel and rate limited in roseentrez to follow NCBI Guidelines
+    Accessions already in the cache are not requested again"""
+    regions = regions or {}
+    if extras:
+        print("Supermatrix markers are taken from whole records, hits on genomes are fetched in full...", "\n")
+        records = fetchrecords(accessionlist, batchsize, cache, workers, fields, None, featurequals([marker] + list(extras)), maxsequence = None)
+    else:
+        records = fetchrecords(accessionlist, batchsize, cache, workers, fields, regions, featurequals([marker] + list(extras)))
+    """Marker sequences of every record in one pass"""
+    markers = extract(records, accessionlist, [marker] + list(extras))
 
-        sequence = ET.SubElement(root, "Sequence")
+    """Go through each accession from the input list in blast order"""
+    for accession in accessionlist:
+        if accession not in records:
+            print("Entrez returned no record for ", accession, " excluding..")
+            continue
+        metadata = [records[accession]]
 
-        """Add a new element off number"""
-        ET.SubElement(sequence, "Sequence_num").text = str(count)
-        ET.SubElement(sequence, "Sequence_accession").text = accession
-        ET.SubElement(sequence, "Sequence_id").text = metadata[0]['GBSeq_organism']
+        """Add a new entry off number"""
+        entry = {"num": count, "accession": accession, "organism": metadata[0]['GBSeq_organism'],
+                 "authors": None, "sequence": None, "sources": []}
+        entries.append(entry)
 
         for feature in metadata[0]['GBSeq_references']:
             if feature['GBReference_reference'] == '1':
-                ET.SubElement(sequence, "Authors").text = str(feature.get('GBReference_authors'))
+                entry["authors"] = str(feature.get('GBReference_authors'))
 
-        """Add full sequence for phylogeny"""
-        if "complete genome" or "chromosome" in str(metadata[0]['GBSeq_definition']):
-            rRNAsequence = parse16S(metadata, accession)
-            if rRNAsequence == "Error":
+        """Add full sequence for phylogeny
+        Genomes and windows of long records hold more than the marker so the marker feature is used"""
+        if isgenome(str(metadata[0]['GBSeq_definition'])) or accession in regions:
+            if marker not in markers[accession]:
+                print("Unable to grab ", marker, " sequence from complete genome ", accession, " Likely unannotated.. excluding")
                 continue
-            ET.SubElement(sequence, "full_Sequence").text = rRNAsequence
+            entry["sequence"] = markers[accession][marker]
         else:
-            ET.SubElement(sequence, "full_Sequence").text = metadata[0]['GBSeq_sequence']
+            entry["sequence"] = metadata[0].get('GBSeq_sequence')
 
         """Add source details based on what is available for the given genbank accession"""
         for feature in metadata[0]['GBSeq_feature-table']:
             if feature['GBFeature_key'] == 'source':
-                source = ET.SubElement(sequence, "Source")
+                source = []
                 for qual in feature['GBFeature_quals']:
-                    match qual['GBQualifier_name']:
-                        case 'mol_type':
-                            ET.SubElement(source, "mol_type").text = qual['GBQualifier_value']
-                        case 'isolation_source':
-                            ET.SubElement(source, "isolation_source").text = qual['GBQualifier_value']
-                        case 'host':
-                            ET.SubElement(source, "host").text = qual['GBQualifier_value']
-                        case 'geo_loc_name':
-                            ET.SubElement(source, "geo_loc_name").text = qual['GBQualifier_value']
-                        case 'db_xref':
-                            ET.SubElement(source, "db_xref").text = qual['GBQualifier_value']
+                    if qual['GBQualifier_name'] in fields:
+                        source.append((qual['GBQualifier_name'], qual['GBQualifier_value']))
+                entry["sources"].append(source)
         count += 1
-        """Sleep to follow appropriate NCBI Guidelines for requests"""
-        time.sleep(0.5)
 
-    """Output final xml file"""
-    outputxml = ET.ElementTree(root)
-    outputxml.write("blastmetadata.xml")
+    """Further markers for the supermatrix"""
+    for extra in extras:
+        os.makedirs("markers", exist_ok = True)
+        found = [(">" + accession + " " + records[accession]['GBSeq_organism'], markers[accession][extra])
+                 for accession in accessionlist if extra in markers.get(accession, {})]
+        writerecords(os.path.join("markers", extra + ".fasta"), found)
+        print("Found ", extra, " in ", len(found), " records")
+
+    """Output metadata store and compatible xml file"""
+    writestore(entries, "Rosetree metadata from blast of " + inputblast, "Part of program made by Fletcher Falk", fields = fields)
+    exportxml()
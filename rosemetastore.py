@@ -0,0 +1,173 @@
+"""Metadata store for Rosetree
+Keeps parsed Entrez metadata in a columnar SQLite file indexed on accession and genus.
+Full sequences live in a separate blob table so renders never load them.
+blastmetadata.xml is exported from the store for compatibility.
+Developed by: Fletcher Falk"""
+import os, re, sqlite3, zlib, hashlib
+from xml.etree import ElementTree as ET
+
+STORE = "blastmetadata.sqlite"
+XML = "blastmetadata.xml"
+
+"""Source qualifiers kept from each GenBank record by default (--metadata)"""
+SOURCE_FIELDS = ("mol_type", "isolation_source", "host", "geo_loc_name", "db_xref")
+
+"""Source qualifiers are column names, only plain identifiers are allowed in the SQL"""
+FIELD_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+"""Fixed columns of the sequences table, qualifiers cannot reuse them"""
+RESERVED = ("position", "num", "accession", "organism", "genus", "authors", "sourcecount")
+
+"""Source qualifiers as store columns: identifiers only, duplicates (SQLite names ignore case) dropped
+Raises ValueError for names that are not identifiers or clash with a fixed column"""
+def checkfields(fields):
+    checked = []
+    for field in fields:
+        if not FIELD_NAME.match(field):
+            raise ValueError("Invalid source qualifier " + repr(field) + ", use letters, digits and underscores only")
+        if field.lower() in RESERVED:
+            raise ValueError("Source qualifier " + repr(field) + " clashes with the store column of the same name")
+        if field.lower() not in (name.lower() for name in checked):
+            checked.append(field)
+    return tuple(checked)
+
+"""Qualifier that can have its own column, the others are only kept in the sources table"""
+def iscolumn(field):
+    return bool(FIELD_NAME.match(field)) and field.lower() not in RESERVED
+
+"""Genus of an organism name, skipping the uncultured prefix"""
+def genus(organism):
+    tmplist = organism.split(" ")
+    if tmplist[0] == "uncultured" and len(tmplist) > 1:
+        return tmplist[1]
+    return tmplist[0]
+
+"""Deterministic calm/lighter tone color for a genus
+Each channel is taken from the genus hash in the 197-240 range used for legibility"""
+def genuscolor(genus):
+    digest = hashlib.md5(genus.encode()).digest()
+    return ('#%02x%02x%02x' % tuple(197 + digest[channel] % 44 for channel in range(3))).upper()
+
+"""Create an empty store
+sequences has one column per field (first value of each source qualifier),
+sources keeps every qualifier in order so the xml export is exact"""
+def createstore(path, fields = SOURCE_FIELDS):
+    fields = checkfields(fields)
+    if os.path.isfile(path):
+        os.remove(path)
+    db = sqlite3.connect(path)
+    db.executescript("""
+        CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE sequences (position INTEGER PRIMARY KEY, num INTEGER, accession TEXT, organism TEXT, genus TEXT, authors TEXT,
+                                sourcecount INTEGER, %s);
+        CREATE TABLE blobs (accession TEXT PRIMARY KEY, sequence BLOB);
+        CREATE TABLE sources (accession TEXT, source INTEGER, position INTEGER, name TEXT, value TEXT);
+        CREATE INDEX sequences_accession ON sequences (accession);
+        CREATE INDEX sequences_genus ON sequences (genus);
+        CREATE INDEX sources_accession ON sources (accession);
+    """ % ", ".join('"%s" TEXT' % field for field in fields))
+    return db
+
+"""Write metadata entries into a new store
+Each entry is a dict of num, accession, organism, authors, sequence (None when it could not be extracted)
+and sources (list of source features, each a list of (qualifier, value))
+fields are the source qualifiers that get their own column"""
+def writestore(entries, info, dev, path = STORE, fields = SOURCE_FIELDS):
+    fields = checkfields(fields)
+    db = createstore(path, fields)
+    db.executemany("INSERT INTO info VALUES (?, ?)", [("Info", info), ("Dev", dev)])
+    for position, entry in enumerate(entries):
+        first = {}
+        for source in entry["sources"]:
+            for name, value in source:
+                first.setdefault(name, value)
+        db.execute("INSERT INTO sequences VALUES (%s)" % ", ".join("?" * (7 + len(fields))),
+                   [position, entry["num"], entry["accession"], entry["organism"], genus(entry["organism"]), entry["authors"], len(entry["sources"])]
+                   + [first.get(field) for field in fields])
+        if entry["sequence"] is not None:
+            db.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?)", (entry["accession"], zlib.compress(entry["sequence"].encode())))
+        db.executemany("INSERT INTO sources VALUES (?, ?, ?, ?, ?)",
+                       [(entry["accession"], number, order, name, value)
+                        for number, source in enumerate(entry["sources"]) for order, (name, value) in enumerate(source)])
+    db.commit()
+    db.close()
+
+"""Build a store from an existing blastmetadata.xml (older runs or the alternative metadata script)"""
+def importxml(xmlpath = XML, path = STORE):
+    root = ET.parse(xmlpath).getroot()
+    entries = []
+    fields = list(SOURCE_FIELDS)
+    for sequence in root.findall('Sequence'):
+        entries.append({"num": int(sequence.findtext('Sequence_num')), "accession": sequence.findtext('Sequence_accession'),
+                        "organism": sequence.findtext('Sequence_id'), "authors": sequence.findtext('Authors'),
+                        "sequence": sequence.findtext('full_Sequence'),
+                        "sources": [[(field.tag, field.text) for field in source] for source in sequence.findall('Source')]})
+        fields += [name for source in entries[-1]["sources"] for name, _ in source if name not in fields and iscolumn(name)]
+    writestore(entries, root.findtext('Info'), root.findtext('Dev'), path, fields)
+
+"""Open a store for reading, (re)importing the xml when the store is missing or older"""
+def openstore(path = STORE, xmlpath = XML):
+    if os.path.isfile(xmlpath) and (not os.path.isfile(path) or os.path.getmtime(xmlpath) > os.path.getmtime(path)):
+        importxml(xmlpath, path)
+    return sqlite3.connect(path)
+
+"""Export the store as blastmetadata.xml in the original layout"""
+def exportxml(path = STORE, xmlpath = XML):
+    db = sqlite3.connect(path)
+    info = dict(db.execute("SELECT key, value FROM info"))
+    root = ET.Element("MetadataOutput")
+    ET.SubElement(root, "Info",).text = info.get("Info")
+    ET.SubElement(root, "Dev",).text = info.get("Dev")
+    sources = {}
+    for accession, number, name, value in db.execute("SELECT accession, source, name, value FROM sources ORDER BY accession, source, position"):
+        sources.setdefault(accession, {}).setdefault(number, []).append((name, value))
+    for num, accession, organism, authors, sourcecount, blob in db.execute("SELECT sequences.num, sequences.accession, organism, authors, sourcecount, blobs.sequence FROM sequences "
+                                                              "LEFT JOIN blobs ON sequences.accession = blobs.accession ORDER BY position"):
+        sequence = ET.SubElement(root, "Sequence")
+        ET.SubElement(sequence, "Sequence_num").text = str(num)
+        ET.SubElement(sequence, "Sequence_accession").text = accession
+        ET.SubElement(sequence, "Sequence_id").text = organism
+        if authors is not None:
+            ET.SubElement(sequence, "Authors").text = authors
+        if blob is None:
+            continue
+        ET.SubElement(sequence, "full_Sequence").text = zlib.decompress(blob).decode()
+        for number in range(sourcecount):
+            source = ET.SubElement(sequence, "Source")
+            for name, value in sources.get(accession, {}).get(number, []):
+                ET.SubElement(source, name).text = value
+    db.close()
+    ET.ElementTree(root).write(xmlpath)
+    """Keep the store newer than its own export so it is not imported back"""
+    os.utime(path)
+
+"""Accession, organism and sequence of every entry with a sequence, in blast order"""
+def sequences(path = STORE):
+    db = openstore(path)
+    rows = [(accession, organism, zlib.decompress(blob).decode()) for accession, organism, blob in
+            db.execute("SELECT sequences.accession, organism, blobs.sequence FROM sequences "
+                       "JOIN blobs ON sequences.accession = blobs.accession ORDER BY position")]
+    db.close()
+    return rows
+
+"""Unique genera in the store"""
+def genera(path = STORE):
+    db = openstore(path)
+    rows = [row[0] for row in db.execute("SELECT DISTINCT genus FROM sequences")]
+    db.close()
+    return rows
+
+"""Source qualifier columns of an open store"""
+def storefields(db):
+    return [row[1] for row in db.execute("PRAGMA table_info(sequences)")][7:]
+
+"""Accession to organism, genus and only the requested source columns"""
+def records(columns = (), path = STORE):
+    db = openstore(path)
+    columns = [column for column in columns if column in storefields(db)]
+    rows = {}
+    for row in db.execute("SELECT accession, organism, genus%s FROM sequences ORDER BY position" % "".join(', "%s"' % column for column in columns)):
+        if row[0] not in rows:
+            rows[row[0]] = {"organism": row[1], "genus": row[2], "source": dict(zip(columns, row[3:]))}
+    db.close()
+    return rows
@@ -2,78 +2,154 @@
 Writes the results of blast from XML into FASTA for alignment and phylogeny.
 Developed by: Fletcher Falk"""
 import os
+from collections import namedtuple
 from xml.etree import ElementTree as ET
+from rosefasta import readfirst, writerecord, countrecords, recordname
+from rosemetastore import sequences
+
+"""Blast hit with the stats and subject coordinates of its best HSP"""
+BlastHit = namedtuple("BlastHit", ["accession", "evalue", "identity", "bitscore", "hit_from", "hit_to", "hit_len"],
+                      defaults = (None, None, None))
+
+"""Hits on subjects at least this long have only a window around the HSP fetched from Entrez,
+REGION_FLANK bases on each side so the whole marker gene is covered"""
+REGION_MINLENGTH = 20000
+REGION_FLANK = 2000
+
+"""Stream hits out of a blast xml file
+Each Hit is cleared and dropped from the tree once yielded so memory stays bounded"""
+def blasthits(xmlfile):
+    parent = None
+    for event, element in ET.iterparse(xmlfile, events=("start", "end")):
+        if event == "start":
+            if element.tag == "Iteration_hits":
+                parent = element
+            continue
+        if element.tag != "Hit":
+            continue
+        hsp = element.find("Hit_hsps/Hsp")
+        length = int(element.findtext("Hit_len")) if element.findtext("Hit_len") else None
+        if hsp is None:
+            yield BlastHit(element.findtext("Hit_accession"), None, None, None, hit_len = length)
+        else:
+            identity = 100 * float(hsp.findtext("Hsp_identity")) / float(hsp.findtext("Hsp_align-len"))
+            yield BlastHit(element.findtext("Hit_accession"), float(hsp.findtext("Hsp_evalue")),
+                           round(identity, 2), float(hsp.findtext("Hsp_bit-score")),
+                           int(hsp.findtext("Hsp_hit-from")), int(hsp.findtext("Hsp_hit-to")), length)
+        element.clear()
+        if parent is not None:
+            parent.remove(element)
+
+"""Insertion ordered set of hit accessions shared across all queries
+Iterates like the old hit list (blast order) and records which queries each accession came from"""
+class HitRegistry:
+    def __init__(self):
+        """Accession to stats of its first hit, and accession to list of queries"""
+        self.hits = {}
+        self.provenance = {}
+
+    def __contains__(self, accession):
+        return accession in self.hits
+
+    def __iter__(self):
+        return iter(self.hits)
+
+    def __len__(self):
+        return len(self.hits)
+
+    """Add a hit from a query, returns False when the accession was already registered"""
+    def add(self, hit, query):
+        queries = self.provenance.setdefault(hit.accession, [])
+        if query not in queries:
+            queries.append(query)
+        if hit.accession in self.hits:
+            return False
+        self.hits[hit.accession] = hit
+        return True
+
+    """Queries an accession was hit by"""
+    def queries(self, accession):
+        return self.provenance.get(accession, [])
+
+    """Write provenance for downstream stages"""
+    def writeprovenance(self, path = "hitprovenance.tsv"):
+        with open(path, "w") as output:
+            output.write("accession\tqueries\tevalue\tidentity\tbitscore\thit_from\thit_to\thit_len\n")
+            for accession, hit in self.hits.items():
+                output.write("\t".join([accession, ",".join(self.queries(accession)), str(hit.evalue), str(hit.identity),
+                                        str(hit.bitscore), str(hit.hit_from), str(hit.hit_to), str(hit.hit_len)]) + "\n")
 
 """Grab all blast results for Entrez"""
-def blastresults(root, hit_list):
+def blastresults(xmlfile, hit_list, query = None):
     """Write rest of blast results into file"""
-    for hit in root.findall('.//Hit'):
-        """Add accession to list for metadata
+    for hit in blasthits(xmlfile):
+        """Add accession to registry for metadata
         Checking for dupes of accession (could happen in multi mode)"""
-        if hit.findtext('Hit_accession') in hit_list:
+        if not hit_list.add(hit, query):
             print ("Dupe in blast list, skipping parsing...")
-            continue  
-        hit_list.append(hit.findtext('Hit_accession'))
     return hit_list
 
+"""Windows to fetch for hits on long subjects (complete genomes, chromosomes)
+Reads the provenance written by the parse stage, returns accession to (start, stop) of the HSP plus flanks"""
+def hitregions(path = "hitprovenance.tsv", minlength = REGION_MINLENGTH, flank = REGION_FLANK):
+    regions = {}
+    if not os.path.isfile(path):
+        return regions
+    with open(path, "r") as provenance:
+        header = next(provenance).rstrip("\n").split("\t")
+        for line in provenance:
+            row = dict(zip(header, line.rstrip("\n").split("\t")))
+            if row.get("hit_len", "None") == "None" or row.get("hit_from", "None") == "None" or int(row["hit_len"]) < minlength:
+                continue
+            start, stop = sorted((int(row["hit_from"]), int(row["hit_to"])))
+            regions[row["accession"]] = (max(1, start - flank), min(int(row["hit_len"]), stop + flank))
+    return regions
+
 """Start new fasta file for results"""
-def writefasta(path, root, hit_list):
-    """Read contents from input sequence to append in"""
-    inputsequence = open(path, "r")
-    inputid = inputsequence.readline().replace('\n', '')
+def writefasta(path, xmlfile, hit_list, fastafile = "blastresults.fasta"):
+    """Read input sequence to append in, wrapped sequences are joined"""
+    inputid, sequence = readfirst(path)
+    if not inputid or not sequence:
+        raise ValueError(path + " has no fasta record (expected a '>' title line followed by a sequence)")
     """Open file and write input sequence"""
-    newfasta = open("blastresults.fasta", "a")
-    """Since readline earlier put first line into file instead of open and close"""
-    newfasta.write(inputid)
-    newfasta.write('\n')
-    newfasta.write(inputsequence.readline())
-    newfasta.write('\n')
-    inputsequence.close()
+    with open(fastafile, "a") as newfasta:
+        writerecord(newfasta, inputid, sequence)
 
     """Return final list and input sequences"""
-    newfasta.close()
-    hit_list = blastresults(root, hit_list)
+    hit_list = blastresults(xmlfile, hit_list, recordname(inputid))
     return hit_list, inputid
 
 """Write rest of blast results with associated metadata from Entrez"""
 def writefinalfasta():
-    xmltree = ET.parse("blastmetadata.xml")
-    root = xmltree.getroot()
     finalfasta = open("blastresults.fasta", "a")
-    """For each sequence in parsed xml"""
-    for sequence in root.findall('.//Sequence'):
-        lines = [">", sequence.findtext('Sequence_accession'), " ", sequence.findtext('Sequence_id'), "\n", sequence.findtext('full_Sequence'), "\n"]
+    """For each sequence in the metadata store (entries without a sequence are skipped)"""
+    for accession, organism, sequence in sequences():
+        lines = [">", accession, " ", organism, "\n", sequence, "\n"]
         finalfasta.writelines(lines)
     finalfasta.close()
 
 """XML Parser Function"""
-def parsexml(path):
+def parsexml(path, fastafile = "blastresults.fasta"):
     print("Writing blast results for Entrez...", "\n")
-    xmltree = ET.parse("blast1.xml")
-    root = xmltree.getroot()
-    hit_list = []
-    return writefasta(path, root, hit_list)
+    hit_list = HitRegistry()
+    return writefasta(path, "blast1.xml", hit_list, fastafile)
 
 """XML Multi Parser Function"""
-def multiparsexml(path):
+def multiparsexml(path, fastafile = "blastresults.fasta"):
     print("Writing multiple sequence blast results for Entrez...", "\n")
     blastseqs = [os.path.join(path, file) for file in os.listdir(path)]
-    hit_list = []
+    hit_list = HitRegistry()
     inputsequences = []
     blastnum = 1
     """For each blast sequence parse info into xml"""
     for blast in blastseqs:
-        xmltree = ET.parse(("blast" + str(blastnum) + ".xml"))
-        root = xmltree.getroot()
-        sequence = writefasta(blast, root, hit_list)[1]
+        sequence = writefasta(blast, "blast" + str(blastnum) + ".xml", hit_list, fastafile)[1]
         inputsequences.append(sequence)
         blastnum += 1
     """Return final list and input sequences"""
     return hit_list, inputsequences
 
 def linecheck():
-    """Check number of lines written, should be (2*blast number) + 2"""
-    writecheck = open("blastresults.fasta", "r")
-    checklines = len(writecheck.readlines())
-    writecheck.close()
-    print("Finished parsing.. ", "Wrote: ", checklines, " lines to document blastresults.fasta", "\n")  
+    """Check number of records written, should be blast number + inputs (+ outgroup)"""
+    checkrecords = countrecords("blastresults.fasta")
+    print("Finished parsing.. ", "Wrote: ", checkrecords, " sequences to document blastresults.fasta", "\n")  
@@ -0,0 +1,103 @@
+"""Run instrumentation for Rosetree
+Records wall time, CPU time, child peak RSS and bytes read/written for every stage and external command.
+Developed by: Fletcher Falk"""
+import os, json, time, resource, cProfile
+from contextlib import contextmanager
+
+"""Bytes read and written by this process (rchar/wchar include network and pipes)"""
+def selfio():
+    counters = {}
+    try:
+        with open("/proc/self/io", "r") as io:
+            for line in io:
+                name, value = line.split(":")
+                counters[name] = int(value)
+    except OSError:
+        pass
+    return counters.get("rchar", 0), counters.get("wchar", 0)
+
+"""Snapshot of counters used to measure a stage or command"""
+def snapshot():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    read, written = selfio()
+    return {"wall": time.perf_counter(), "cpu": own.ru_utime + own.ru_stime,
+            "child_cpu": children.ru_utime + children.ru_stime,
+            "read": read + children.ru_inblock * 512, "written": written + children.ru_oublock * 512}
+
+"""Difference between two snapshots
+ru_maxrss of children is a high water mark (KB on linux) so it is reported as is"""
+def measure(start, name):
+    end = snapshot()
+    return {"name": name,
+            "wall_s": round(end["wall"] - start["wall"], 3),
+            "cpu_s": round(end["cpu"] - start["cpu"], 3),
+            "child_cpu_s": round(end["child_cpu"] - start["child_cpu"], 3),
+            "child_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+            "read_bytes": end["read"] - start["read"],
+            "written_bytes": end["written"] - start["written"]}
+
+"""Profiler for the pipeline
+Stages hold the commands that ran inside them"""
+class Profiler:
+    def __init__(self):
+        self.stages = []
+        self.current = None
+        """Dump cProfile output of Python stages when set (--profile)"""
+        self.cprofile = False
+        self.profiledir = "profiles"
+
+    """Measure a pipeline stage"""
+    @contextmanager
+    def stage(self, name):
+        record = {"name": name, "commands": []}
+        self.current = record
+        start = snapshot()
+        profile = cProfile.Profile() if self.cprofile else None
+        if profile:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile:
+                profile.disable()
+                os.makedirs(self.profiledir, exist_ok=True)
+                profile.dump_stats(os.path.join(self.profiledir, name + ".prof"))
+            record.update(measure(start, name))
+            self.stages.append(record)
+            self.current = None
+
+    """Record a stage that was skipped on resume"""
+    def skipped(self, name):
+        self.stages.append({"name": name, "skipped": True, "commands": []})
+
+    """Measure an external command inside the current stage
+    The caller can add exact numbers for the command (e.g. its own peak RSS) to the yielded record"""
+    @contextmanager
+    def command(self, command):
+        start = snapshot()
+        extra = {}
+        try:
+            yield extra
+        finally:
+            if self.current is not None:
+                record = measure(start, command)
+                record.update(extra)
+                self.current["commands"].append(record)
+
+    """Write machine readable metrics"""
+    def write(self, path = "run_metrics.json"):
+        with open(path, "w") as metrics:
+            json.dump({"stages": self.stages}, metrics, indent = 2)
+
+    """Summary table at the end of the run"""
+    def summary(self):
+        print("%-10s %10s %10s %12s %14s %10s %10s" % ("stage", "wall (s)", "cpu (s)", "child cpu", "child rss MB", "read MB", "write MB"))
+        for record in self.stages:
+            if record.get("skipped"):
+                print("%-10s %10s" % (record["name"], "skipped"))
+                continue
+            print("%-10s %10.1f %10.1f %12.1f %14.1f %10.1f %10.1f" % (record["name"], record["wall_s"], record["cpu_s"], record["child_cpu_s"],
+                  record["child_peak_rss_mb"], record["read_bytes"] / 1e6, record["written_bytes"] / 1e6))
+
+profiler = Profiler()
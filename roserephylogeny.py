@@ -2,9 +2,11 @@
 Uses ETE3 to build a phylogeny and annotate with parsed metadata
 This can be ran after the complete pipeline if you want to make edits and rerun the
 rendering.
+The tree (as newick), metadata index and leaf labels are cached in rendersession.json so
+style changes only redo the drawing.
 Developed by: Fletcher Falk"""
 import os, argparse
-from rosephylogeny import phylogeny
+from roselabels import renderer
 
 """Arguments for running the program"""
 def argument_parser():
@@ -12,6 +14,22 @@ def argument_parser():
     parser = argparse.ArgumentParser(description="RosePhylogeny Argument List")
     parser.add_argument("--input", "-i", 
                         help="Rerender the phylogeny using the input tree file", required=True)
+    parser.add_argument("--output", "-o", 
+                        help="Name of the rendered tree without extension, default: final-tree-rerender", default="final-tree-rerender")
+    parser.add_argument("--columns", "-c", 
+                        help="Comma separated source metadata columns to show (e.g. host,geo_loc_name), default: none", default="")
+    parser.add_argument("--support-cutoff", "-sc", type=float,
+                        help="Smallest bootstrap support value drawn on branches, default: 60", default=60)
+    parser.add_argument("--label-size", "-ls", type=int,
+                        help="Font size of leaf labels, default: 11", default=11)
+    parser.add_argument("--hide-branch-length", "-hb", action="store_true",
+                        help="Do not draw branch lengths")
+    parser.add_argument("--backend", "-b", choices=["ete", "svg"],
+                        help="Tree renderer: ete (ETE3/Qt) or svg (headless pure Python, no Qt needed), default: ete", default="ete")
+    parser.add_argument("--format", "-f", choices=["pdf", "svg"],
+                        help="File format of the rendered tree, default: pdf", default="pdf")
+    parser.add_argument("--hide-leaf-names", "-hl", action="store_true",
+                        help="Do not draw accession leaf names")
     """Return arguments"""
     return parser.parse_args()
 
@@ -19,16 +37,21 @@ def roserephylogeny(args):
     """Assign arguments"""
     input = (args.input)
     """Draw Tree"""
-    print("Drawing final tree with ETE...\n", "Note: if an error occurs you may have to manually install PyQt5: as it didn't install with ete3...\n",
-    "run: pip3 install PyQt5")
+    if args.backend == "ete":
+        print("Drawing final tree with ETE...\n", "Note: if an error occurs you may have to manually install PyQt5: as it didn't install with ete3...\n",
+        "run: pip3 install PyQt5")
 
     """Phylogeny data for rerun"""
     phydata = open("phydata", "r")
     inputblast = phydata.readline()
-    phylogeny(input, inputblast, "final-tree-rerender")
+    phydata.close()
+    columns = [column for column in args.columns.split(",") if column]
+    style = {"support_cutoff": args.support_cutoff, "label_size": args.label_size,
+             "show_branch_length": not args.hide_branch_length, "show_leaf_name": not args.hide_leaf_names}
+    renderer(args.backend)(input, inputblast, args.output, columns, style, args.format)
 
     """Done"""
-    print("Final tree exported as pdf...")
+    print("Final tree exported as " + args.format + "...")
     print("Bye!")
 
 """Main: sets up arguments and runs program"""
@@ -0,0 +1,69 @@
+"""Thread planning for Rosetree
+Splits the --threads budget between MAFFT, ModelTest-NG and RAxML-NG based on the alignment.
+Developed by: Fletcher Falk"""
+import re
+from roseexecute import execute
+from roseprofile import profiler
+from rosefasta import fastadimensions
+
+"""Print the decision and keep it with the stage metrics"""
+def logplan(tool, plan):
+    print("Thread plan for ", tool, ": ", ", ".join(str(key) + "=" + str(value) for key, value in plan.items()))
+    if profiler.current is not None:
+        profiler.current["plan"] = plan
+    return plan
+
+"""MAFFT gains little from threads on small inputs, roughly one thread per 25 sequences"""
+def mafftplan(fastafile, threads):
+    taxa, sites = fastadimensions(fastafile)
+    return logplan("mafft", {"taxa": taxa, "sites": sites, "threads": max(1, min(int(threads), taxa // 25))})
+
+"""ModelTest-NG parallelises over candidate models so it can use the whole budget"""
+def modeltestplan(msa, threads):
+    taxa, sites = fastadimensions(msa)
+    return logplan("modeltest-ng", {"taxa": taxa, "sites": sites, "threads": int(threads)})
+
+"""Ask raxml-ng --parse how many threads the alignment can use
+Remaining threads go to parallel bootstrap workers (--workers)"""
+def raxmlplan(msa, model, threads, timeout = None):
+    threads = int(threads)
+    taxa, sites = fastadimensions(msa)
+    execute(["raxml-ng", "--parse", "--msa", msa, "--model", model, "--prefix", "threadplan", "--threads", threads, "--redo"],
+            log = "logs/threadplan.log", timeout = timeout)
+    recommended = threads
+    with open("threadplan.raxml.log", "r") as log:
+        found = re.search(r"Recommended number of threads / MPI processes: (\d+)", log.read())
+        if found:
+            recommended = int(found.group(1))
+    pertree = max(1, min(threads, recommended))
+    workers = max(1, threads // pertree)
+    return logplan("raxml-ng", {"taxa": taxa, "sites": sites, "recommended": recommended,
+                                "threads": pertree * workers, "workers": workers})
+
+"""Bootstrap settings for RAxML-NG
+fixed keeps 2500 replicates and 25+25 starting trees, adaptive stops bootstrapping once the
+autoMRE criterion converges (up to cutoff replicates) and scales starting trees with taxon count"""
+def bootstrapplan(msa, mode = "fixed", cutoff = 1000):
+    taxa, sites = fastadimensions(msa)
+    if mode == "adaptive":
+        starting = max(5, min(25, taxa // 4))
+        return {"mode": mode, "taxa": taxa, "tree": "pars{%d},rand{%d}" % (starting, starting), "bs_trees": "autoMRE{%d}" % int(cutoff)}
+    return {"mode": mode, "taxa": taxa, "tree": "pars{25},rand{25}", "bs_trees": "2500"}
+
+"""Convergence statistics from a finished RAxML-NG run"""
+def bootstrapconvergence(prefix):
+    stats = {"replicates": None, "converged": None}
+    try:
+        with open(prefix + ".raxml.bootstraps", "r") as bootstraps:
+            stats["replicates"] = sum(1 for line in bootstraps if line.strip())
+        with open(prefix + ".raxml.log", "r") as log:
+            text = log.read()
+    except OSError:
+        return stats
+    converged = re.search(r"Bootstrapping converged after (\d+) replicates", text)
+    if converged:
+        stats["converged"] = True
+        stats["converged_after"] = int(converged.group(1))
+    elif "autoMRE" in text:
+        stats["converged"] = False
+    return stats
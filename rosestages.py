@@ -0,0 +1,65 @@
+"""Pipeline stages for Rosetree
+Records the input hashes and outputs of each stage in a manifest so a rerun can skip unchanged stages.
+Developed by: Fletcher Falk"""
+import os, json, hashlib
+from roseprofile import profiler
+
+"""Manifest written next to the pipeline output"""
+MANIFEST = "rosetree_manifest.json"
+
+"""Separate manifest for --add-samples so it never replaces the records of the main run"""
+ADD_MANIFEST = "rosetree_add_manifest.json"
+
+"""sha256 of a file, None if it does not exist"""
+def filehash(path):
+    if not os.path.isfile(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+"""Stage manifest
+Each stage records its input file hashes, parameters, output file hashes and a small json result"""
+class Manifest:
+    def __init__(self, path = MANIFEST, resume = False):
+        self.path = path
+        self.resume = resume
+        self.stages = {}
+        if resume and os.path.isfile(path):
+            with open(path, "r") as manifest:
+                self.stages = json.load(manifest)["stages"]
+
+    """Input fingerprint for a stage, normalised through json so it compares with a loaded manifest"""
+    def fingerprint(self, inputs, params):
+        return json.loads(json.dumps({"files": {path: filehash(path) for path in inputs}, "params": params}))
+
+    """Stage is fresh when its inputs are unchanged and its outputs are still on disk as written"""
+    def fresh(self, name, fingerprint):
+        record = self.stages.get(name)
+        if record is None or record["inputs"] != fingerprint:
+            return False
+        return all(filehash(path) == digest for path, digest in record["outputs"].items())
+
+    """Run a stage unless --resume finds it fresh
+    Old outputs are removed first so stages that append start from an empty file
+    Every stage that runs is measured by the profiler"""
+    def run(self, name, func, inputs = (), outputs = (), params = None):
+        fingerprint = self.fingerprint(inputs, params)
+        if self.resume and self.fresh(name, fingerprint):
+            print("Resuming: stage ", name, " is unchanged, skipping...\n")
+            profiler.skipped(name)
+            return self.stages[name]["result"]
+        for path in outputs:
+            if os.path.isfile(path):
+                os.remove(path)
+        with profiler.stage(name):
+            result = func()
+        self.stages[name] = {"inputs": fingerprint, "outputs": {path: filehash(path) for path in outputs}, "result": result}
+        self.save()
+        return result
+
+    def save(self):
+        with open(self.path, "w") as manifest:
+            json.dump({"stages": self.stages}, manifest, indent = 2)
@@ -0,0 +1,115 @@
+"""Supermatrix mode for Rosetree
+Aligns and trims each marker in parallel, selects a model per partition concurrently
+and concatenates the trimmed alignments into one supermatrix with a RAxML-NG partition file.
+Developed by: Fletcher Falk"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from roseexecute import execute
+from rosefasta import readfasta, recordname, writerecords, alignmentarray
+
+"""Concatenated alignment and its partition file"""
+SUPERMATRIX = "supermatrix.fasta"
+PARTITIONS = "supermatrix.partition"
+
+"""Fewest taxa a marker needs to become a partition (RAxML-NG and ModelTest-NG need at least 4)"""
+MIN_TAXA = 4
+
+"""Keep only the records of taxa in the main marker input (dereplicated away taxa are dropped from every partition)"""
+def filtermarker(fastafile, keep, output):
+    keep = set(keep)
+    records = [(title, sequence) for title, sequence in readfasta(fastafile) if recordname(title) in keep]
+    writerecords(output, records)
+    return len(records)
+
+"""Split the thread budget between partitions running at the same time"""
+def partitionthreads(threads, partitions):
+    return max(1, int(threads) // max(1, partitions))
+
+"""Align then trim one marker, returns its timing"""
+def alignpartition(name, fastafile, aligned, threads, timeout = None):
+    start = time.perf_counter()
+    execute(["mafft", "--auto", "--quiet", "--thread", threads, fastafile], log = "logs/mafft-" + name + ".log", stdout = aligned, timeout = timeout)
+    aligntime = time.perf_counter() - start
+    execute(["clipkit", aligned], log = "logs/clipkit-" + name + ".log", timeout = timeout)
+    return {"marker": name, "align_s": round(aligntime, 3), "trim_s": round(time.perf_counter() - start - aligntime, 3)}
+
+"""Align and trim every marker in parallel
+partitions is a list of (marker, fasta input, aligned output), the trimmed alignment is aligned output + .clipkit"""
+def alignpartitions(partitions, threads, timeout = None):
+    perpartition = partitionthreads(threads, len(partitions))
+    with ThreadPoolExecutor(max_workers = len(partitions)) as pool:
+        jobs = [pool.submit(alignpartition, name, fastafile, aligned, perpartition, timeout) for name, fastafile, aligned in partitions]
+        return {job.result()["marker"]: job.result() for job in jobs}
+
+"""RAxML-NG model chosen by ModelTest-NG from its .out file, a file without one is an error"""
+def modelfromout(path):
+    with open(path, "r") as optimalmodel:
+        for line in optimalmodel:
+            if "raxml-ng" in line:
+                return line.split(" ")[-1].rstrip("\n")
+    raise RuntimeError("ModelTest-NG selected no RAxML-NG model in " + path)
+
+"""Run ModelTest-NG on one partition, returns its model and timing"""
+def testpartition(name, msa, threads, candidates = (), timeout = None):
+    start = time.perf_counter()
+    execute(["modeltest-ng", "-i", msa, "-t", "ml", "-p", threads, "-r", "12345"] + list(candidates),
+            log = "logs/modeltest-" + name + ".log", timeout = timeout)
+    return {"marker": name, "model": modelfromout(msa + ".out"), "modeltest_s": round(time.perf_counter() - start, 3)}
+
+"""Select a model for every partition, partitions not in the model cache are tested concurrently
+partitions is a list of (marker, trimmed alignment), returns marker to {model, modeltest_s, cached}"""
+def selectmodels(partitions, threads, candidates = (), timeout = None, modelcache = None):
+    results = {}
+    missing = []
+    """Cache lookups stay on this thread (sqlite connections are not shared across threads)"""
+    for name, msa in partitions:
+        model = modelcache.get(modelcache.key(msa, candidates)) if modelcache else None
+        if model:
+            print("Model found in cache for partition ", name, ": ", model)
+            results[name] = {"marker": name, "model": model, "modeltest_s": 0.0, "cached": True}
+        else:
+            missing.append((name, msa))
+    if missing:
+        perpartition = partitionthreads(threads, len(missing))
+        with ThreadPoolExecutor(max_workers = len(missing)) as pool:
+            jobs = [pool.submit(testpartition, name, msa, perpartition, candidates, timeout) for name, msa in missing]
+            for (name, msa), job in zip(missing, jobs):
+                results[name] = dict(job.result(), cached = False)
+                print("Model selected for partition ", name, ": ", results[name]["model"])
+                if modelcache:
+                    modelcache.put(modelcache.key(msa, candidates), results[name]["model"])
+    return results
+
+"""Concatenate trimmed alignments into a supermatrix
+Taxa missing from a partition are filled with gaps, taxa keep the order they first appear in.
+partitions is a list of (marker, trimmed alignment), models marker to model, writes the fasta and partition file"""
+def concatenate(partitions, models, output = SUPERMATRIX, partitionfile = PARTITIONS):
+    taxa = {}
+    blocks = []
+    for name, msa in partitions:
+        names, array = alignmentarray(msa)
+        for taxon in names:
+            taxa.setdefault(taxon, len(taxa))
+        blocks.append((name, names, array))
+    columns = sum(array.shape[1] for _, _, array in blocks)
+    matrix = np.full((len(taxa), columns), ord("-"), dtype=np.uint8)
+    ranges = []
+    offset = 0
+    for name, names, array in blocks:
+        rows = [taxa[taxon] for taxon in names]
+        matrix[rows, offset:offset + array.shape[1]] = array
+        ranges.append((name, offset + 1, offset + array.shape[1]))
+        offset += array.shape[1]
+    writerecords(output, ((">" + taxon, matrix[row].tobytes().decode()) for taxon, row in taxa.items()))
+    with open(partitionfile, "w") as partition:
+        for name, first, last in ranges:
+            partition.write("%s, %s = %d-%d\n" % (models[name], name, first, last))
+    return {"taxa": len(taxa), "columns": columns, "partitions": ranges}
+
+"""Per partition timing table at the end of the supermatrix stages"""
+def report(timings):
+    print("%-8s %10s %10s %14s %20s" % ("marker", "align (s)", "trim (s)", "modeltest (s)", "model"))
+    for name, timing in timings.items():
+        print("%-8s %10.1f %10.1f %14s %20s" % (name, timing.get("align_s", 0), timing.get("trim_s", 0),
+              "cached" if timing.get("cached") else "%.1f" % timing.get("modeltest_s", 0), timing.get("model", "")))
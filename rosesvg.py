@@ -0,0 +1,361 @@
+"""Headless phylogeny renderer for Rosetree
+Draws the tree and the same metadata faces as rosephylogeny straight to SVG or PDF.
+Pure Python: no ete3 or Qt, so it starts fast and many renders can run in parallel processes.
+Developed by: Fletcher Falk"""
+from roselabels import STYLE, loadlabels
+
+"""Approximate Helvetica advance width as a fraction of the font size"""
+CHARWIDTH = 0.56
+
+"""Width of the tree (excluding labels) in points"""
+TREEWIDTH = 400
+
+"""Tree node parsed from newick"""
+class Node:
+    __slots__ = ("name", "dist", "support", "children", "x", "y")
+
+    def __init__(self):
+        self.name = ""
+        self.dist = 1.0
+        self.support = 1.0
+        self.children = []
+        self.x = 0.0
+        self.y = 0.0
+
+    def is_leaf(self):
+        return not self.children
+
+    """Nodes in preorder, iterative so deep trees do not hit the recursion limit"""
+    def traverse(self):
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def leaves(self):
+        return [node for node in self.traverse() if node.is_leaf()]
+
+"""Label of a node, numeric internal labels are support values (as ETE reads raxml support trees)"""
+def setlabel(node, label):
+    label = label.strip().strip("'\"")
+    if not label:
+        return
+    if node.children:
+        try:
+            node.support = float(label)
+            return
+        except ValueError:
+            pass
+    node.name = label
+
+"""Parse a newick string into Nodes"""
+def parsenewick(newick):
+    root = Node()
+    stack = []
+    node = root
+    token = ""
+    field = "label"
+    position = 0
+    text = newick.strip()
+    while position < len(text):
+        char = text[position]
+        if char == "[":
+            """Skip comments"""
+            position = text.index("]", position)
+        elif char == "(":
+            child = Node()
+            node.children.append(child)
+            stack.append(node)
+            node = child
+        elif char in ",);":
+            if field == "dist":
+                node.dist = float(token)
+            else:
+                setlabel(node, token)
+            token = ""
+            field = "label"
+            if char == ",":
+                child = Node()
+                stack[-1].children.append(child)
+                node = child
+            elif char == ")":
+                node = stack.pop()
+            else:
+                break
+        elif char == ":":
+            setlabel(node, token)
+            token = ""
+            field = "dist"
+        else:
+            token += char
+        position += 1
+    return root
+
+"""Parse a newick file"""
+def readtree(inputtree):
+    with open(inputtree, "r") as treefile:
+        return parsenewick(treefile.read())
+
+"""Find a node by name"""
+def search(tree, name):
+    for node in tree.traverse():
+        if node.name == name:
+            return node
+    raise ValueError("Node " + name + " not found in tree")
+
+"""Reroot on the branch above the named node (halfway along it, as ETE set_outgroup), returns the new root"""
+def setoutgroup(tree, name):
+    target = search(tree, name)
+    if target is tree:
+        return tree
+    """Path from the root down to the outgroup"""
+    parents = {}
+    for node in tree.traverse():
+        for child in node.children:
+            parents[id(child)] = node
+    path = [target]
+    while path[-1] is not tree:
+        path.append(parents[id(path[-1])])
+    path.reverse()
+    dists = [node.dist for node in path]
+    supports = [node.support for node in path]
+    """Reverse every edge on the path so the old root hangs below"""
+    for number in range(len(path) - 1, 0, -1):
+        path[number - 1].children.remove(path[number])
+    for number in range(1, len(path) - 1):
+        path[number].children.append(path[number - 1])
+        path[number - 1].dist = dists[number]
+        path[number - 1].support = supports[number]
+    root = Node()
+    target.dist = dists[-1] / 2
+    path[-2].dist = dists[-1] / 2
+    path[-2].support = supports[-1]
+    root.children = [target, path[-2]]
+    """The old root is dropped when it is left with a single child"""
+    old = path[0]
+    if len(old.children) == 1:
+        above = path[1] if len(path) > 2 else root
+        only = old.children[0]
+        only.dist += old.dist
+        above.children[above.children.index(old)] = only
+    return root
+
+"""Remove the named leaves, dropping empty clades and joining single child nodes, returns the new root"""
+def prune(tree, names):
+    names = set(names)
+    empty = set()
+    for node in reversed(list(tree.traverse())):
+        if not node.children:
+            continue
+        kept = []
+        for child in node.children:
+            if id(child) in empty or (not child.children and child.name in names):
+                continue
+            if len(child.children) == 1:
+                only = child.children[0]
+                only.dist += child.dist
+                child = only
+            kept.append(child)
+        node.children = kept
+        if not kept:
+            empty.add(id(node))
+    while len(tree.children) == 1:
+        tree = tree.children[0]
+    return tree
+
+"""Estimated width of a (possibly multi line) text"""
+def textwidth(text, size):
+    return max(len(line) for line in text.split("\n")) * size * CHARWIDTH
+
+"""Escape text for xml"""
+def svgescape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+"""SVG drawing surface, y grows downwards"""
+class SVGCanvas:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.items = []
+
+    def line(self, x1, y1, x2, y2, color = "black", width = 1):
+        self.items.append('<line x1="%.2f" y1="%.2f" x2="%.2f" y2="%.2f" stroke="%s" stroke-width="%s"/>' % (x1, y1, x2, y2, color, width))
+
+    def rect(self, x, y, width, height, color):
+        self.items.append('<rect x="%.2f" y="%.2f" width="%.2f" height="%.2f" fill="%s"/>' % (x, y, width, height, color))
+
+    def text(self, x, y, text, size, color = "black"):
+        self.items.append('<text x="%.2f" y="%.2f" font-family="Helvetica, Arial, sans-serif" font-size="%s" fill="%s">%s</text>'
+                          % (x, y, size, color, svgescape(text)))
+
+    def save(self, path):
+        with open(path, "w") as output:
+            output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            output.write('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d">\n'
+                         % (self.width, self.height, self.width, self.height))
+            output.write('<rect width="100%" height="100%" fill="white"/>\n')
+            output.write("\n".join(self.items))
+            output.write("\n</svg>\n")
+
+"""Named colors used by the faces, anything else is expected as #RRGGBB"""
+COLORS = {"black": (0, 0, 0), "white": (1, 1, 1), "red": (1, 0, 0), "gray": (0.5, 0.5, 0.5)}
+
+"""Color as pdf rgb components"""
+def pdfcolor(color):
+    if color in COLORS:
+        return COLORS[color]
+    color = color.lstrip("#")
+    return tuple(int(color[i:i + 2], 16) / 255 for i in (0, 2, 4))
+
+"""Escape text for a pdf string, characters outside latin-1 are replaced"""
+def pdfescape(text):
+    return text.encode("latin-1", "replace").decode("latin-1").replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+"""Single page PDF drawing surface using the built in Helvetica font
+Takes the same top-down coordinates as the SVG canvas and flips them"""
+class PDFCanvas:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.items = []
+
+    def line(self, x1, y1, x2, y2, color = "black", width = 1):
+        self.items.append("%.3f %.3f %.3f RG %s w %.2f %.2f m %.2f %.2f l S" % (pdfcolor(color) + (width, x1, self.height - y1, x2, self.height - y2)))
+
+    def rect(self, x, y, width, height, color):
+        self.items.append("%.3f %.3f %.3f rg %.2f %.2f %.2f %.2f re f" % (pdfcolor(color) + (x, self.height - y - height, width, height)))
+
+    def text(self, x, y, text, size, color = "black"):
+        self.items.append("%.3f %.3f %.3f rg BT /F1 %s Tf %.2f %.2f Td (%s) Tj ET" % (pdfcolor(color) + (size, x, self.height - y, pdfescape(text))))
+
+    def save(self, path):
+        content = "\n".join(self.items).encode("latin-1")
+        objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+                   b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+                   ("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>"
+                    % (self.width, self.height)).encode(),
+                   b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+                   b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream"]
+        output = bytearray(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start = 1):
+            offsets.append(len(output))
+            output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+        xref = len(output)
+        output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+        for offset in offsets:
+            output += b"%010d 00000 n \n" % offset
+        output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%EOF\n" % (len(objects) + 1, xref)
+        with open(path, "wb") as pdf:
+            pdf.write(output)
+
+"""Multi line text with its first baseline at y"""
+def drawtext(canvas, x, y, text, size, color = "black"):
+    for number, line in enumerate(text.split("\n")):
+        canvas.text(x, y + number * size * 1.2, line, size, color)
+
+"""Text on a colored background box, returns its width"""
+def drawbox(canvas, x, y, text, size, background, color = "black"):
+    width = textwidth(text, size) + 2
+    canvas.rect(x, y - size * 0.85, width, size * 1.15, background)
+    drawtext(canvas, x + 1, y, text, size, color)
+    return width
+
+"""Assign coordinates: x from branch lengths, leaves one row apart, internal nodes centred on their children"""
+def layout(tree, rowheight):
+    nodes = list(tree.traverse())
+    tree.x = 0.0
+    for node in nodes:
+        for child in node.children:
+            child.x = node.x + child.dist
+    depth = max(node.x for node in nodes) or 1.0
+    leaves = tree.leaves()
+    for number, leaf in enumerate(leaves):
+        leaf.y = number * rowheight
+    for node in reversed(nodes):
+        node.x = node.x / depth * TREEWIDTH
+        if node.children:
+            node.y = (node.children[0].y + node.children[-1].y) / 2
+    return nodes, leaves
+
+"""Draw a parsed tree with its labels and write it as svg or pdf"""
+def draw(tree, labels, treename, style = None, fmt = "pdf"):
+    style = dict(STYLE, **(style or {}))
+    size = style["label_size"]
+    """Rows are tall enough for metadata columns that wrap onto several lines"""
+    lines = max([text.count("\n") + 1 for label in labels.values() for text in label["columns"]] or [1])
+    rowheight = max(size * 1.6, style["support_size"] * 2.6, lines * style["column_size"] * 1.2 + 4)
+    nodes, leaves = layout(tree, rowheight)
+    margin = 25
+
+    """Faces next to each leaf (name, sample, organism) as (text, background, color)"""
+    def leaffaces(leaf):
+        faces = []
+        label = labels.get(leaf.name)
+        if style["show_leaf_name"]:
+            faces.append((leaf.name, None, "black"))
+        if label and label["sample"]:
+            faces.append(("Sample: " + str(label["sample"]), style["sample_color"], style["sample_text"]))
+        if label and label["organism"]:
+            faces.append((label["organism"], label["color"], "black"))
+        return faces
+    extents = {}
+    for leaf in leaves:
+        extents[leaf.name] = leaf.x + 4 + sum(textwidth(text, size) + 4 for text, _, _ in leaffaces(leaf))
+    aligned = max(extents.values(), default = 0) + 15
+    columnwidths = []
+    for column in range(max((len(label["columns"]) for label in labels.values()), default = 0)):
+        columnwidths.append(max(textwidth(label["columns"][column], style["column_size"]) for label in labels.values()
+                                if len(label["columns"]) > column) + 15)
+
+    width = int(margin * 2 + aligned + sum(columnwidths)) + 1
+    height = int(margin + 50 + rowheight * len(leaves)) + size
+    canvas = (SVGCanvas if fmt == "svg" else PDFCanvas)(width, height)
+
+    def X(x):
+        return margin + x
+    def Y(y):
+        return margin + size + y
+
+    """Branches"""
+    for node in nodes:
+        if node.children:
+            canvas.line(X(node.x), Y(node.children[0].y), X(node.x), Y(node.children[-1].y))
+        for child in node.children:
+            canvas.line(X(node.x), Y(child.y), X(child.x), Y(child.y))
+            if style["show_branch_length"]:
+                canvas.text(X(node.x) + 1, Y(child.y) - 2, "%g" % round(child.dist, 4), 6, "gray")
+            """Bootstrapping support values below the branch"""
+            if child.children and child.support >= style["support_cutoff"]:
+                canvas.text(X(node.x) + 1, Y(child.y) + style["support_size"] + 1, "%g" % child.support, style["support_size"], style["support_color"])
+
+    """Leaf faces"""
+    for leaf in leaves:
+        x = X(leaf.x) + 4
+        y = Y(leaf.y) + size * 0.35
+        for text, background, color in leaffaces(leaf):
+            if background:
+                x += drawbox(canvas, x, y, text, size, background, color) + 4
+            else:
+                drawtext(canvas, x, y, text, size, color)
+                x += textwidth(text, size) + 4
+        label = labels.get(leaf.name)
+        if not label:
+            continue
+        """Mark tips that represent a cluster of collapsed near identical sequences"""
+        if label["collapsed"]:
+            canvas.text(X(leaf.x) + 4, Y(leaf.y) + 11, " * +" + str(label["collapsed"]), 9, "red")
+        """Aligned metadata columns"""
+        x = X(aligned)
+        for column, text in enumerate(label["columns"]):
+            drawtext(canvas, x, y, text, style["column_size"], "gray")
+            x += columnwidths[column]
+    canvas.save(treename + "." + fmt)
+
+"""Phylogeny Function, same arguments as rosephylogeny.phylogeny"""
+def phylogeny(inputtree, inputblast, treename, columns = (), style = None, fmt = "pdf"):
+    print("Drawing final maximum likelihood tree (headless " + fmt + ")...\n")
+    tree = readtree(inputtree)
+    _, labels = loadlabels([leaf.name for leaf in tree.leaves()], inputblast, columns)
+    draw(tree, labels, treename, style, fmt)
@@ -0,0 +1,27 @@
+"""Request throttling for Rosetree
+Token bucket shared between threads so NCBI request-rate limits hold without fixed sleeps.
+Developed by: Fletcher Falk"""
+import time, threading
+
+"""Token bucket rate limiter
+rate is requests per second, capacity is how many requests can burst at once"""
+class TokenBucket:
+    def __init__(self, rate, capacity = 1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    """Block until a request is allowed"""
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
@@ -5,19 +5,32 @@ Program blasts a given input sample to NCBI and constructs a phylogeny based on
 Metadata from NCBI is also parsed and used to supplement phylogeny output."""
 
 """Importing libraries"""
-import os, subprocess, argparse, sys
+import os, argparse, shutil, sys
 from pathlib import Path
 from Bio import Blast, Entrez
 from Bio.Seq import Seq
-from roseparser import parsexml, multiparsexml, linecheck, writefinalfasta
+from roseparser import parsexml, multiparsexml, linecheck, writefinalfasta, hitregions
 from rosemetadata import metaparser
-from rosephylogeny import phylogeny
+from rosemetastore import SOURCE_FIELDS, checkfields
+from rosemarkers import MARKERS
+from rosecache import RecordCache, ModelCache
+import roseentrez
+from roselabels import renderer
 from roseblast import nuc_blast, multi_blast
+from rosestages import Manifest, ADD_MANIFEST
+from roseprofile import profiler
+from roseexecute import execute
+from rosedereplicate import dereplicate
+from rosefasta import readfasta, readfirst, recordname, writerecords, writerecord, alignmentarray, columnstats
+from roseresources import mafftplan, modeltestplan, raxmlplan, bootstrapplan, bootstrapconvergence
+from rosesupermatrix import SUPERMATRIX, PARTITIONS, MIN_TAXA, filtermarker, alignpartitions, selectmodels, modelfromout, concatenate, report
 
-"""Function to execute bash commands"""
-def execute(command):
-    result = subprocess.run(command, shell=True, check=True, text=True, capture_output=True)
-    print(result.stdout, "\n", result.stderr)
+"""Parse the --metadata list of source qualifiers, checked before any Entrez request"""
+def metadata_fields(value):
+    try:
+        return checkfields(field.strip() for field in value.split(",") if field.strip())
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
 
 """Arguments for running the program"""
 def argument_parser():
@@ -37,32 +50,76 @@ def argument_parser():
                         help="Turn on multiple sequence mode (True) to allow multiple inputs. Takes a directory of fasta files and blasts all taking default results.", default=False)
     parser.add_argument("--multiblasttotal", "-mb",
                         help="Specify total number of blast results to use when running multisequencemode. Default is 10.", default=10)
+    parser.add_argument("--blast-backend", "-bb", choices=["remote", "local"],
+                        help="Run BLAST remotely on NCBI (remote) or with BLAST+ against a local database (local). Default is remote.", default="remote")
+    parser.add_argument("--blast-db", "-db",
+                        help="Fasta file for the local BLAST database. Built with makeblastdb on first use.")
+    parser.add_argument("--add-samples", "-as", action="store_true",
+                        help="Add the input sample(s) to the finished tree in this directory: aligns them into the existing alignment and runs a search constrained by the existing tree. Skips BLAST and Entrez.")
+    parser.add_argument("--resume", "-r", action="store_true",
+                        help="Skip pipeline stages whose inputs have not changed since the last run in this directory.")
+    parser.add_argument("--dereplicate", "-dr",
+                        help="Collapse near identical sequences at this identity (e.g. 0.99) before alignment, keeping one per cluster. Default is off.")
+    parser.add_argument("--models", "-m",
+                        help="Limit ModelTest-NG candidate models, comma separated (e.g. GTR,HKY). Default is all.")
+    parser.add_argument("--model-freqs", "-mf",
+                        help="ModelTest-NG candidate model frequency/rate options (e.g. uigf). Default is ModelTest-NG's.")
+    parser.add_argument("--bootstrap", "-bs", choices=["fixed", "adaptive"],
+                        help="fixed runs 2500 bootstrap replicates, adaptive stops once the autoMRE criterion converges. Default is fixed.", default="fixed")
+    parser.add_argument("--bs-cutoff", "-bc",
+                        help="Maximum bootstrap replicates in adaptive mode (autoMRE{N}). Default is 1000.", default=1000)
+    parser.add_argument("--timeout", "-to",
+                        help="Stop an external tool (MAFFT, ClipKIT, ModelTest-NG, RAxML-NG) after this many seconds. Default is no limit.")
+    parser.add_argument("--render-backend", "-rb", choices=["ete", "svg"],
+                        help="Tree renderer: ete (ETE3/Qt) or svg (headless pure Python, no Qt needed). Default is ete.", default="ete")
+    parser.add_argument("--render-format", "-rf", choices=["pdf", "svg"],
+                        help="File format of the rendered tree. Default is pdf.", default="pdf")
+    parser.add_argument("--profile", "-p", action="store_true",
+                        help="Dump cProfile output of each stage into ./profiles.")
+    parser.add_argument("--entrezbatch", "-eb",
+                        help="Specify number of accessions fetched per Entrez request. Default is 200.", default=200)
+    parser.add_argument("--entrezworkers", "-ew",
+                        help="Specify number of parallel Entrez requests. Default is 3.", default=3)
+    parser.add_argument("--metadata", "-md", type=metadata_fields,
+                        help="Comma separated source qualifiers kept from each GenBank record (e.g. host,geo_loc_name). Default is mol_type,isolation_source,host,geo_loc_name,db_xref.",
+                        default=",".join(SOURCE_FIELDS))
+    parser.add_argument("--marker", "-mk", choices=sorted(MARKERS),
+                        help="Marker gene taken from genome records, the input samples should be the same locus. Default is 16S.", default="16S")
+    parser.add_argument("--supermatrix", "-sx",
+                        help="Comma separated further markers (e.g. rpoB,gyrB) concatenated with --marker into a partitioned supermatrix. Default is off.")
+    parser.add_argument("--api-key", "-k",
+                        help="NCBI API key, raises the Entrez request rate from 3 to 10 per second.")
+    parser.add_argument("--cache-dir", "-cd",
+                        help="Directory for the persistent GenBank record cache. Reruns skip Entrez for cached accessions.")
+    parser.add_argument("--cache-ttl",
+                        help="Days before a cached GenBank record is fetched again. Default is 30.", default=30)
+    parser.add_argument("--cache-size",
+                        help="Maximum size of the GenBank cache in MB. Default is 1024.", default=1024)
     """Return arguments"""
     return parser.parse_args()
 
-"""Check valid fasta"""
+"""Check valid fasta, the file has to hold at least one record with a sequence"""
 def valid_fasta(file):
     if os.path.splitext(file)[1] not in (".fasta", ".fa"):
         print("Invalid file format...\n" "Requires .fasta or .fa")
         sys.exit()
+    title, sequence = readfirst(file)
+    if not title or not sequence:
+        print("Error... " + file + " has no fasta record (expected a '>' title line followed by a sequence), exiting.")
+        sys.exit()
 
-"""Single blast mode"""
-def single_mode(path, blastnum, multiblastnum = 10):
+"""Check single blast mode input, returns the input file"""
+def single_check(path):
     """Check if file exists before starting"""
     if Path(path).is_file() == False:
         print("Error... File does not exist, exiting.")
         sys.exit()
     """Check valid fasta file path"""
     valid_fasta(path)
+    return [path]
 
-    """Blast single fasta to NCBI"""
-    print("Taking top ", blastnum, " results.\n")
-    nuc_blast(path, blastnum, 1)
-    """Parse xml into fasta"""
-    return parsexml(path)
-
-"""Multi blast mode"""
-def multi_mode(path, blastnum, multiblastnum):
+"""Check multi blast mode input, returns the input files"""
+def multi_check(path):
     """Check if directory exists before starting"""
     if Path(path).is_dir() == False:
         print("Error... Multiple sequence mode is enabled, therefore path requires directory.")
@@ -70,15 +127,33 @@ def multi_mode(path, blastnum, multiblastnum):
     files = os.listdir(path)
     """Check valid fasta files in directory"""
     for file in files:
-        valid_fasta(file)
-    
+        valid_fasta(os.path.join(path, file))
+    return [os.path.join(path, file) for file in files]
+
+"""Single blast mode"""
+def single_mode(path, blastnum, multiblastnum = 10, blastoptions = None):
+    """Blast single fasta to NCBI"""
+    blastoptions = blastoptions or {}
+    print("Taking top ", blastnum, " results.\n")
+    nuc_blast(path, blastnum, 1, **blastoptions)
+
+"""Multi blast mode"""
+def multi_mode(path, blastnum, multiblastnum, blastoptions = None):
     """Blast multi fasta to NCBI"""
+    blastoptions = blastoptions or {}
     print("Running in multiple sequence mode, taking top ", multiblastnum, " results from each input...\n")
     if blastnum != 50:
         print("Notice: you set the total blast number argument.\n You are running in multisequencemode",
         " if you want to change the blast number set it instead with -mb")
-    multi_blast(path, multiblastnum)
-    return multiparsexml(path)
+    multi_blast(path, multiblastnum, **blastoptions)
+
+"""Outgroup name for RAxML from the outgroup fasta title"""
+def outgroup_name(outgroup):
+    return ["--outgroup", recordname(readfirst(outgroup)[0])]
+
+"""Write outgroup to fasta for alignment"""
+def write_outgroup(outgroup, fastafile):
+    writerecords(fastafile, [readfirst(outgroup)], "a")
 
 """Runs the RoseTree program"""
 def rosetree(args):
@@ -92,98 +167,331 @@ def rosetree(args):
     mode = args.multiplesequencemode 
     Blast.email = args.email
     Entrez.email = args.email
+    roseentrez.setup(args.api_key, args.email)
 
     """Start"""
     print("--- Running RoseTree v0.1 --- \n", "Using ", threads, " threads... \n", "Be sure to checkout my GitHub :) \n", 
-    "https://github.com/Fletcher-F \n", "File(s) path = ", path, "\n", "Note: if rerunning program, ensure you are working in a new directory or move old output.\n",
-    "Results are appended and will cause errors in downstream steps.\n\n", "Note: ensure fasta input is only 2 lines: one for title, one for sequence.\n\n"
+    "https://github.com/Fletcher-F \n", "File(s) path = ", path, "\n", "Note: rerunning in the same directory replaces old output.\n",
+    "Use --resume to skip stages whose inputs have not changed since the last run.\n\n"
     "Running qblast using Biopython on nucleotide database...\n")
 
-    """Checking outgroup input
-    Then write to fasta for alignment"""
+    """Checking outgroup input"""
     if outgroup:
         print("You specified an outgroup, checking valid format..\n")
         valid_fasta(outgroup)
-        outgroup = open(outgroup, "r")
-        initialfasta = open("blastresults.fasta", "a")
-        outgroupname = outgroup.readline()
-        initialfasta.write(outgroupname)
-        outgroupname = "--outgroup " + outgroupname.split(" ")[0].replace(">", "")
-        initialfasta.write(outgroup.readline())
-        initialfasta.write("\n")
-        initialfasta.close()
+        outgroupname = outgroup_name(outgroup)
     else:
         print("WARNING: No outgroup was given. Recommend restarting the program with an outgroup (-o ./test/outgroup.fasta\n)")
-        outgroupname = None
+        outgroupname = []
 
     modes = {
-        "False": single_mode,
-        "True": multi_mode
+        "False": (single_check, single_mode, parsexml),
+        "True": (multi_check, multi_mode, multiparsexml)
     }
-    hit_list, inputblast = modes.get(mode, single_mode)(path, blastnum, multiblastnum)
-
-    """Convert input blast to string for downstream use
-    returned as list if given multiple fastas in multiple sequence mode"""
-    if type(inputblast) is list:
-        inputblast = (", ".join(str(x) for x in inputblast))
-    inputblast = inputblast.replace(">", "")
-    
+    check, blastmode, parser = modes.get(mode, modes["False"])
+    inputfiles = check(path)
+    blastfiles = ["blast" + str(num) + ".xml" for num in range(1, len(inputfiles) + 1)]
+
+    """Stage manifest, finished stages with unchanged inputs are skipped with --resume"""
+    manifest = Manifest(resume = args.resume)
+
+    """Local BLAST+ or remote qblast"""
+    blastoptions = {"backend": args.blast_backend, "database": args.blast_db, "threads": threads}
+    manifest.run("blast", lambda: blastmode(path, blastnum, multiblastnum, blastoptions),
+                 inputs = inputfiles, outputs = blastfiles,
+                 params = {"mode": mode, "blastnum": blastnum if mode != "True" else multiblastnum,
+                           "backend": args.blast_backend, "database": args.blast_db})
+
+    """Parse xml into fasta, outgroup first then input sequences"""
+    def parse():
+        if outgroup:
+            write_outgroup(outgroup, "blastinputs.fasta")
+        hit_list, inputblast = parser(path, "blastinputs.fasta")
+
+        """Convert input blast to string for downstream use
+        returned as list if given multiple fastas in multiple sequence mode"""
+        if type(inputblast) is list:
+            inputblast = (", ".join(str(x) for x in inputblast))
+        inputblast = inputblast.replace(">", "")
+
+        """Record which input each hit came from"""
+        hit_list.writeprovenance()
+        return {"hit_list": list(hit_list), "inputblast": inputblast}
+    parsed = manifest.run("parse", parse, inputs = inputfiles + blastfiles + ([outgroup] if outgroup else []),
+                          outputs = ["blastinputs.fasta", "hitprovenance.tsv"])
+    hit_list, inputblast = parsed["hit_list"], parsed["inputblast"]
+
     """Pull metadata after parsing"""
-    metaparser(hit_list, inputblast)
+    cache = None
+    if args.cache_dir:
+        cache = RecordCache(args.cache_dir, args.cache_ttl, args.cache_size)
+    fields = args.metadata
+    """Hits on genomes only fetch the window around their HSP"""
+    regions = hitregions()
+    """Further markers for supermatrix mode"""
+    extras = [marker for marker in (args.supermatrix or "").split(",") if marker and marker != args.marker]
+    for marker in extras:
+        if marker not in MARKERS:
+            print("Unknown marker ", marker, " for --supermatrix, choose from ", ", ".join(sorted(MARKERS)))
+            sys.exit()
+    manifest.run("metadata", lambda: metaparser(hit_list, inputblast, int(args.entrezbatch), cache, int(args.entrezworkers), fields, regions, args.marker, extras),
+                 inputs = ["hitprovenance.tsv"], outputs = ["blastmetadata.sqlite", "blastmetadata.xml"] + ["markers/" + marker + ".fasta" for marker in extras],
+                 params = dict(parsed, fields = fields, marker = args.marker, extras = extras))
+    if cache:
+        cache.close()
 
     """Write rest of blast results into fasta after pulling complete sequence with Entrez"""
-    writefinalfasta()
+    def fasta():
+        shutil.copyfile("blastinputs.fasta", "blastresults.fasta")
+        writefinalfasta()
+        """Check lines written"""
+        linecheck()
+    manifest.run("fasta", fasta, inputs = ["blastinputs.fasta", "blastmetadata.sqlite"], outputs = ["blastresults.fasta"])
 
-    """Check lines written"""
-    linecheck()
+    """Collapse near identical sequences, input samples and outgroup are always kept"""
+    alignmentinput = "blastresults.fasta"
+    if args.dereplicate:
+        def derep():
+            protected = [recordname(title) for title, sequence in readfasta("blastinputs.fasta")]
+            dereplicate("blastresults.fasta", "derepresults.fasta", "clustermap.tsv", float(args.dereplicate), protected)
+        manifest.run("dereplicate", derep, inputs = ["blastinputs.fasta", "blastresults.fasta"],
+                     outputs = ["derepresults.fasta", "clustermap.tsv"], params = {"identity": args.dereplicate})
+        alignmentinput = "derepresults.fasta"
+    elif os.path.isfile("clustermap.tsv"):
+        os.remove("clustermap.tsv")
 
     """MAFFT for sequence alignment of fasta"""
-    print("Performing alignment from results using MAFFT...")
-    alignment = "mafft --auto --quiet --thread %s blastresults.fasta > alignedresults.fasta" % threads
-    execute(alignment)
+    def mafft():
+        print("Performing alignment from results using MAFFT...")
+        plan = mafftplan(alignmentinput, threads)
+        alignment = ["mafft", "--auto", "--quiet", "--thread", plan["threads"], alignmentinput]
+        execute(alignment, log = "logs/mafft.log", stdout = "alignedresults.fasta", timeout = args.timeout)
+        stats = columnstats(alignmentarray("alignedresults.fasta")[1])
+        print("Alignment: ", stats["taxa"], " sequences x ", stats["columns"], " columns, ", round(100 * stats["gap_fraction"], 1), "% gaps, ",
+              stats["informative"], " parsimony informative columns")
+        return stats
+    """Partitions of supermatrix mode, the main marker keeps the single marker file names
+    Further markers found in fewer than MIN_TAXA of the kept taxa are left out"""
+    partitions = [(args.marker, alignmentinput, "alignedresults.fasta")]
+    if extras:
+        keep = [recordname(title) for title, sequence in readfasta(alignmentinput)]
+        for marker in extras:
+            taxa = filtermarker("markers/" + marker + ".fasta", keep, "markers/" + marker + ".filtered.fasta")
+            print("Supermatrix marker ", marker, ": found in ", taxa, " of ", len(keep), " taxa")
+            if taxa < MIN_TAXA:
+                print("WARNING: ", marker, " is found in fewer than ", MIN_TAXA, " taxa, leaving it out of the supermatrix")
+                continue
+            partitions.append((marker, "markers/" + marker + ".filtered.fasta", "markers/" + marker + ".aligned.fasta"))
+    def partitionalign():
+        print("Aligning and trimming ", len(partitions), " markers in parallel using MAFFT and ClipKIT...")
+        timings = alignpartitions(partitions, threads, args.timeout)
+        stats = columnstats(alignmentarray("alignedresults.fasta")[1])
+        print("Alignment of ", args.marker, ": ", stats["taxa"], " sequences x ", stats["columns"], " columns, ", round(100 * stats["gap_fraction"], 1), "% gaps")
+        return {"timings": timings, "stats": stats}
+    if extras:
+        partitioned = manifest.run("partitions", partitionalign, inputs = [fastafile for _, fastafile, _ in partitions],
+                                   outputs = [aligned for _, _, aligned in partitions] + [aligned + ".clipkit" for _, _, aligned in partitions],
+                                   params = {"partitions": [marker for marker, _, _ in partitions]})
+    else:
+        manifest.run("mafft", mafft, inputs = [alignmentinput], outputs = ["alignedresults.fasta"])
 
     """Trim alignment with ClipKIT"""
-    print("Trimming alignment results using ClipKIT...")
-    trim = "clipkit alignedresults.fasta"
-    execute(trim)
-
-    """Perform model test on alignment"""
-    print("Running model test on alignment results...")
-    modeltest = "modeltest-ng -i alignedresults.fasta.clipkit -t ml -p %s -r 12345" % threads
-    execute(modeltest)
-
-    optimalmodel = open("alignedresults.fasta.clipkit.out", "r")
-    for line in optimalmodel:
-        if "raxml-ng" in line:
-            commands = line.split(" ")
-            command = commands[-1].rstrip("\n")
-            print("Model selected: ", command)
-            break
+    def clipkit():
+        print("Trimming alignment results using ClipKIT...")
+        trim = ["clipkit", "alignedresults.fasta"]
+        execute(trim, log = "logs/clipkit.log", timeout = args.timeout)
+    if not extras:
+        manifest.run("clipkit", clipkit, inputs = ["alignedresults.fasta"], outputs = ["alignedresults.fasta.clipkit"])
+
+    """Perform model test on alignment
+    Selected models are cached by alignment hash, a cache hit skips ModelTest-NG entirely"""
+    candidates = []
+    if args.models:
+        candidates += ["-m", args.models]
+    if args.model_freqs:
+        candidates += ["-h", args.model_freqs]
+    def modeltest():
+        modelcache = ModelCache(args.cache_dir or os.path.expanduser("~/.cache/rosetree"))
+        modelkey = modelcache.key("alignedresults.fasta.clipkit", candidates)
+        command = modelcache.get(modelkey)
+        if command:
+            print("Model found in cache for this alignment, skipping model test: ", command)
+            modelcache.close()
+            return command
+
+        print("Running model test on alignment results...")
+        plan = modeltestplan("alignedresults.fasta.clipkit", threads)
+        modeltest = ["modeltest-ng", "-i", "alignedresults.fasta.clipkit", "-t", "ml", "-p", plan["threads"], "-r", "12345"] + candidates
+        execute(modeltest, log = "logs/modeltest.log", timeout = args.timeout)
+
+        command = modelfromout("alignedresults.fasta.clipkit.out")
+        print("Model selected: ", command)
+        modelcache.put(modelkey, command)
+        modelcache.close()
+        return command
+
+    """Supermatrix mode: one model per partition selected concurrently, then the trimmed partitions are concatenated
+    RAxML-NG gets the partition file as its model"""
+    def partitionmodel():
+        modelcache = ModelCache(args.cache_dir or os.path.expanduser("~/.cache/rosetree"))
+        print("Running model test on ", len(partitions), " partitions concurrently...")
+        models = selectmodels([(marker, aligned + ".clipkit") for marker, _, aligned in partitions], threads, candidates, args.timeout, modelcache)
+        modelcache.close()
+        matrix = concatenate([(marker, aligned + ".clipkit") for marker, _, aligned in partitions],
+                             {marker: result["model"] for marker, result in models.items()})
+        print("Supermatrix: ", matrix["taxa"], " taxa x ", matrix["columns"], " columns in ", len(partitions), " partitions")
+        """Per partition timing, kept with the stage metrics"""
+        timings = {marker: dict(partitioned["timings"][marker], **models[marker]) for marker, _, _ in partitions}
+        if profiler.current is not None:
+            profiler.current["partitions"] = timings
+        report(timings)
+        return PARTITIONS
+    if extras:
+        command = manifest.run("modeltest", partitionmodel, inputs = [aligned + ".clipkit" for _, _, aligned in partitions],
+                               outputs = [SUPERMATRIX, PARTITIONS] + [aligned + ".clipkit.out" for _, _, aligned in partitions],
+                               params = {"candidates": candidates, "partitions": [marker for marker, _, _ in partitions]})
+        msa = SUPERMATRIX
+    else:
+        command = manifest.run("modeltest", modeltest, inputs = ["alignedresults.fasta.clipkit"],
+                               outputs = ["alignedresults.fasta.clipkit." + ext for ext in ("out", "log", "tree", "ckp")],
+                               params = {"candidates": candidates})
+        msa = "alignedresults.fasta.clipkit"
 
     """Phylogeny construction with RaXML"""
-    print("Building maximum likelihood tree with RAxML all-in-one analysis...")
-    mltree = "raxml-ng --all --msa alignedresults.fasta.clipkit --model %s --prefix finaltree --tree pars{25},rand{25} --bs-trees 2500 --bs-metric fbp,tbe --seed 12345 --threads %s %s" % (command, threads, outgroupname)
-    execute(mltree)
+    bootstrap = bootstrapplan(msa, args.bootstrap, args.bs_cutoff)
+    def raxml():
+        print("Building maximum likelihood tree with RAxML all-in-one analysis...")
+        print("Bootstrap settings: ", bootstrap)
+        plan = raxmlplan(msa, command, threads, args.timeout)
+        mltree = ["raxml-ng", "--all", "--msa", msa, "--model", command, "--prefix", "finaltree",
+                  "--tree", bootstrap["tree"], "--bs-trees", bootstrap["bs_trees"], "--bs-metric", "fbp,tbe", "--seed", "12345",
+                  "--threads", plan["threads"], "--redo"] + outgroupname
+        """Parallel bootstrap workers when the alignment cannot use every thread in one tree search"""
+        if plan["workers"] > 1:
+            mltree += ["--workers", plan["workers"]]
+        execute(mltree, log = "logs/raxml.log", timeout = args.timeout)
+        """Settings and convergence statistics are kept in the manifest"""
+        convergence = bootstrapconvergence("finaltree")
+        print("Bootstrap replicates: ", convergence["replicates"], " converged: ", convergence["converged"])
+        return {"bootstrap": bootstrap, "convergence": convergence}
+    manifest.run("raxml", raxml, inputs = [msa] + ([PARTITIONS] if extras else []),
+                 outputs = ["finaltree.raxml." + ext for ext in ("bestTree", "bestModel", "supportFBP", "supportTBE", "bootstraps", "log")],
+                 params = {"model": command, "outgroup": outgroupname, "bootstrap": bootstrap})
 
     """Draw Tree"""
-    print("Drawing final tree (FBP support) with ETE...\n", "Note: if an error occurs you may have to manually install PyQt5: as it didn't install with ete3...\n",
-    "run: pip3 install PyQt5")
-    inputtree = "finaltree.raxml.supportFBP"
-    """Phylogeny data for rerun"""
-    phydata = open("phydata", "a")
-    phydata.write(inputblast)
-    phylogeny(inputtree, inputblast, "final-tree-render")
+    def render():
+        if args.render_backend == "ete":
+            print("Drawing final tree (FBP support) with ETE...\n", "Note: if an error occurs you may have to manually install PyQt5: as it didn't install with ete3...\n",
+            "run: pip3 install PyQt5")
+        inputtree = "finaltree.raxml.supportFBP"
+        """Phylogeny data for rerun"""
+        with open("phydata", "w") as phydata:
+            phydata.write(inputblast)
+        renderer(args.render_backend)(inputtree, inputblast, "final-tree-render", fmt = args.render_format)
+    manifest.run("render", render, inputs = ["finaltree.raxml.supportFBP", "blastmetadata.sqlite", "clustermap.tsv"],
+                 outputs = ["final-tree-render." + args.render_format, "phydata"],
+                 params = {"inputblast": inputblast, "backend": args.render_backend})
 
     """Done"""
-    print("Final tree exported as pdf...")
+    roseentrez.stats.report()
+    if cache:
+        cache.report()
+    print("Final tree exported as " + args.render_format + "...")
     print("Check the model test results and confirm model used.")
     print("If you would like to rerender, use rephylogeny.")
     print("Bye!")
 
+"""Adds new samples to a finished run without recomputing from scratch
+Only the new sequences are aligned into the existing MSA (mafft --add) and placed with a RAxML-NG search
+constrained by the existing best tree, then the tree is re-rendered"""
+def add_samples(args):
+    threads = args.threads
+    modes = {"False": single_check, "True": multi_check}
+    inputfiles = modes.get(args.multiplesequencemode, single_check)(args.input)
+    for required in ("alignedresults.fasta", "finaltree.raxml.bestTree", "finaltree.raxml.bestModel", "phydata"):
+        if not os.path.isfile(required):
+            print("Error... --add-samples needs a finished run in this directory, missing ", required)
+            sys.exit()
+    if args.outgroup:
+        valid_fasta(args.outgroup)
+    outgroupname = outgroup_name(args.outgroup) if args.outgroup else []
+    manifest = Manifest(ADD_MANIFEST, resume = args.resume)
+
+    """Earlier add runs are chained: their alignment and tree are the base unless the main run is newer"""
+    basealignment, basetree = "alignedresults.fasta", "finaltree.raxml.bestTree"
+    if os.path.isfile("addbase.fasta") and os.path.isfile("addbase.raxml.bestTree") and \
+       os.path.getmtime("addbase.raxml.bestTree") >= os.path.getmtime("finaltree.raxml.bestTree"):
+        basealignment, basetree = "addbase.fasta", "addbase.raxml.bestTree"
+        print("Adding to the tree of the previous --add-samples run...")
+
+    """Collect new samples, skipping any already in the alignment"""
+    existing = {recordname(title) for title, sequence in readfasta(basealignment)}
+    def collect():
+        names = []
+        with open("newsamples.fasta", "w") as newsamples:
+            for inputfile in inputfiles:
+                for title, sequence in readfasta(inputfile):
+                    if recordname(title) in existing:
+                        print("Sample ", recordname(title), " is already in the tree, skipping..")
+                        continue
+                    writerecord(newsamples, title, sequence)
+                    names.append(recordname(title))
+        return names
+    names = manifest.run("addcollect", collect, inputs = inputfiles + [basealignment], outputs = ["newsamples.fasta"])
+    if not names:
+        print("No new samples to add. Bye!")
+        return
+
+    """Align only the new sequences into the existing alignment"""
+    def align():
+        print("Aligning new samples into the existing alignment using MAFFT --add...")
+        alignment = ["mafft", "--add", "newsamples.fasta", "--keeplength", "--quiet", "--thread", threads, basealignment]
+        execute(alignment, log = "logs/mafft.log", stdout = "addedresults.fasta", timeout = args.timeout)
+        execute(["clipkit", "addedresults.fasta"], log = "logs/clipkit.log", timeout = args.timeout)
+    manifest.run("addalign", align, inputs = ["newsamples.fasta", basealignment],
+                 outputs = ["addedresults.fasta", "addedresults.fasta.clipkit"])
+
+    """Place new samples with a search constrained by the old tree, reusing its model"""
+    def search():
+        print("Placing new samples with a RAxML-NG search constrained by the existing tree...")
+        placement = ["raxml-ng", "--search", "--msa", "addedresults.fasta.clipkit", "--model", "finaltree.raxml.bestModel",
+                     "--tree-constraint", basetree, "--tree", "pars{5}", "--prefix", "addedtree",
+                     "--seed", "12345", "--threads", threads, "--redo"] + outgroupname
+        execute(placement, log = "logs/raxml.log", timeout = args.timeout)
+    manifest.run("addsearch", search, inputs = ["addedresults.fasta.clipkit", basetree, "finaltree.raxml.bestModel"],
+                 outputs = ["addedtree.raxml.bestTree", "addedtree.raxml.log"], params = {"outgroup": outgroupname})
+
+    """Re-render with the new samples labelled as samples"""
+    def render():
+        with open("phydata", "r") as phydata:
+            inputblast = phydata.readline()
+        inputblast = ", ".join([inputblast] + [name for name in names if name not in inputblast])
+        with open("phydata", "w") as phydata:
+            phydata.write(inputblast)
+        renderer(args.render_backend)("addedtree.raxml.bestTree", inputblast, "added-tree-render", fmt = args.render_format)
+    manifest.run("addrender", render, inputs = ["addedtree.raxml.bestTree", "blastmetadata.sqlite"],
+                 outputs = ["added-tree-render." + args.render_format], params = {"samples": names, "backend": args.render_backend})
+
+    """The finished alignment and tree become the base of the next add run"""
+    shutil.copyfile("addedresults.fasta", "addbase.fasta")
+    shutil.copyfile("addedtree.raxml.bestTree", "addbase.raxml.bestTree")
+
+    print("Tree with new samples exported as " + args.render_format + " (no bootstrap support, the constrained search only places the new samples)...")
+    print("Bye!")
+
 """Main: sets up arguments and runs program"""
 def main():
     args = argument_parser()
-    rosetree(args)
+    profiler.cprofile = args.profile
+    """Metrics are written even if a stage fails"""
+    try:
+        if args.add_samples:
+            add_samples(args)
+        else:
+            rosetree(args)
+    finally:
+        profiler.write()
+        profiler.summary()
 
 """Start Program"""
 if __name__ == "__main__":
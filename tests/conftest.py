@@ -0,0 +1,71 @@
+"""Rosetree modules live at the top of the repository
+Shared fixtures: a local HTTP stand-in for E-utilities"""
+import os, sys, time, threading, urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import roseentrez
+from rosethrottle import TokenBucket
+
+"""GBSeq record as efetch returns it, with a sequence of the given length"""
+def gbseq(accession, length = 8, organism = "Escherichia coli", definition = "16S ribosomal RNA gene", features = ""):
+    return ("<GBSeq><GBSeq_length>%d</GBSeq_length><GBSeq_primary-accession>%s</GBSeq_primary-accession>"
+            "<GBSeq_accession-version>%s.1</GBSeq_accession-version><GBSeq_organism>%s</GBSeq_organism>"
+            "<GBSeq_definition>%s %s</GBSeq_definition>"
+            "<GBSeq_references><GBReference><GBReference_reference>1</GBReference_reference>"
+            "<GBReference_authors><GBAuthor>Falk,F.</GBAuthor></GBReference_authors></GBReference></GBSeq_references>"
+            "<GBSeq_feature-table><GBFeature><GBFeature_key>source</GBFeature_key><GBFeature_quals>"
+            "<GBQualifier><GBQualifier_name>host</GBQualifier_name><GBQualifier_value>soil</GBQualifier_value></GBQualifier>"
+            "<GBQualifier><GBQualifier_name>strain</GBQualifier_name><GBQualifier_value>K12</GBQualifier_value></GBQualifier>"
+            "</GBFeature_quals></GBFeature>%s</GBSeq_feature-table>"
+            "<GBSeq_sequence>%s</GBSeq_sequence></GBSeq>") % (length, accession, accession, organism, organism, definition, features, "a" * length)
+
+"""E-utilities stand-in, records maps accessions to their GBSeq xml (gbseq otherwise),
+failures maps a cgi to the status codes its next requests get
+("drop" closes the connection without a response, "stall" answers after the client timeout)"""
+class EUtilities(BaseHTTPRequestHandler):
+    def do_POST(self):
+        cgi = self.path.rsplit("/", 1)[-1]
+        params = dict(urllib.parse.parse_qsl(self.rfile.read(int(self.headers["Content-Length"])).decode()))
+        self.server.requests.append((cgi, params))
+        failures = self.server.failures.get(cgi)
+        failure = failures.pop(0) if failures else None
+        if failure == "drop":
+            self.close_connection = True
+            return
+        if failure == "stall":
+            time.sleep(0.5)
+        elif failure:
+            self.send_error(failure)
+            return
+        if cgi == "epost.fcgi":
+            self.server.posted = params["id"].split(",")
+            body = "<ePostResult><QueryKey>1</QueryKey><WebEnv>WEBENV</WebEnv></ePostResult>"
+        else:
+            if "WebEnv" in params:
+                start = int(params["retstart"])
+                ids = self.server.posted[start:start + int(params["retmax"])]
+            else:
+                ids = params["id"].split(",")
+            body = "<GBSet>" + "".join(self.server.records.get(accession) or gbseq(accession, self.server.lengths.get(accession, 8))
+                                       for accession in ids) + "</GBSet>"
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def eutils(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EUtilities)
+    server.requests, server.failures, server.lengths, server.records, server.posted = [], {}, {}, {}, []
+    thread = threading.Thread(target = server.serve_forever, args = (0.05,), daemon = True)
+    thread.start()
+    monkeypatch.setattr(roseentrez, "EUTILS", "http://127.0.0.1:%d/" % server.server_address[1])
+    monkeypatch.setattr(roseentrez, "BACKOFF", 0.01)
+    monkeypatch.setattr(roseentrez, "bucket", TokenBucket(1000))
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,21 @@
+"""Batch renderer on a deep tree"""
+import os
+from rosebatch import batchrender, loadvariants
+from rosemetastore import STORE, createstore
+
+"""Caterpillar tree, every internal node has one leaf and one deeper subtree"""
+def caterpillar(tips):
+    newick = "(t%d:0.1,t%d:0.1)" % (tips - 1, tips)
+    for tip in range(tips - 2, 0, -1):
+        newick = "(t%d:0.1,%s:0.1)" % (tip, newick)
+    return newick + ";"
+
+def test_batchrender_deep_tree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    createstore(STORE).close()
+    (tmp_path / "deep.tree").write_text(caterpillar(2000))
+    (tmp_path / "variants.json").write_text('[{"name": "deep-plain", "format": "svg"},'
+                                            ' {"name": "deep-rooted", "root": "t1500", "prune": ["t3"], "format": "pdf"}]')
+    batchrender("deep.tree", "", loadvariants("variants.json"), "svg", 2)
+    assert os.path.getsize("deep-plain.svg") > 0
+    assert os.path.getsize("deep-rooted.pdf") > 0
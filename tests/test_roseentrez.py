@@ -0,0 +1,62 @@
+"""Entrez batching and retries against a local HTTP stand-in for E-utilities"""
+import urllib.error
+import pytest
+import roseentrez
+
+def test_small_lists_are_batched_by_id(eutils):
+    accessions = ["AB%04d" % number for number in range(5)]
+    records = roseentrez.fetchrecords(accessions, batchsize = 5)
+    assert [cgi for cgi, params in eutils.requests] == ["efetch.fcgi"]
+    assert eutils.requests[0][1]["id"] == ",".join(accessions)
+    assert sorted(records) == accessions
+    record = records["AB0003"]
+    assert record["GBSeq_organism"] == "Escherichia coli"
+    assert record["GBSeq_references"] == [{"GBReference_reference": "1", "GBReference_authors": ["Falk,F."]}]
+    """Only the requested source qualifiers are kept"""
+    assert record["GBSeq_feature-table"][0]["GBFeature_quals"] == [{"GBQualifier_name": "host", "GBQualifier_value": "soil"}]
+
+def test_big_lists_use_epost(eutils):
+    accessions = ["AB%04d" % number for number in range(7)]
+    records = roseentrez.fetchrecords(accessions, batchsize = 3, workers = 2)
+    cgis = [cgi for cgi, params in eutils.requests]
+    assert cgis == ["epost.fcgi", "efetch.fcgi", "efetch.fcgi", "efetch.fcgi"]
+    assert sorted(int(params["retstart"]) for cgi, params in eutils.requests[1:]) == [0, 3, 6]
+    assert all(accession in records for accession in accessions)
+
+def test_transient_errors_are_retried(eutils):
+    eutils.failures["efetch.fcgi"] = [503, 429]
+    records = roseentrez.fetchrecords(["AB0001"])
+    assert "AB0001" in records
+    assert len(eutils.requests) == 3
+
+def test_dropped_and_stalled_connections_are_retried(eutils, monkeypatch):
+    monkeypatch.setattr(roseentrez, "TIMEOUT", 0.2)
+    eutils.failures["efetch.fcgi"] = ["drop", "stall"]
+    records = roseentrez.fetchrecords(["AB0001"])
+    assert "AB0001" in records
+    assert len(eutils.requests) == 3
+
+def test_client_errors_are_not_retried(eutils):
+    eutils.failures["efetch.fcgi"] = [400]
+    with pytest.raises(urllib.error.HTTPError):
+        roseentrez.fetchrecords(["AB0001"])
+    assert len(eutils.requests) == 1
+
+def test_retries_give_up(eutils, monkeypatch):
+    monkeypatch.setattr(roseentrez, "RETRIES", 2)
+    eutils.failures["efetch.fcgi"] = [500, 502, 503, 504]
+    with pytest.raises(urllib.error.HTTPError):
+        roseentrez.fetchrecords(["AB0001"])
+    assert len(eutils.requests) == 3
+
+def test_long_sequences_are_dropped_unless_kept(eutils):
+    eutils.lengths["NC000913"] = roseentrez.MAXSEQUENCE + 1
+    assert "GBSeq_sequence" not in roseentrez.fetchrecords(["NC000913"])["NC000913"]
+    assert len(roseentrez.fetchrecords(["NC000913"], maxsequence = None)["NC000913"]["GBSeq_sequence"]) == roseentrez.MAXSEQUENCE + 1
+
+def test_regions_are_fetched_as_windows(eutils):
+    records = roseentrez.fetchrecords(["NC000913", "AB0001"], regions = {"NC000913": (100, 1700)})
+    windows = [params for cgi, params in eutils.requests if "seq_start" in params]
+    assert windows == [{"db": "nucleotide", "rettype": "gb", "retmode": "xml", "id": "NC000913", "seq_start": "100", "seq_stop": "1700",
+                        "tool": "rosetree"}]
+    assert "NC000913" in records and "AB0001" in records
@@ -0,0 +1,37 @@
+"""FASTA reader and writer"""
+from rosefasta import (readfasta, readfirst, recordname, countrecords, fastadimensions, writerecords,
+                       alignmentarray, columnstats)
+
+def test_wrapped_records(tmp_path):
+    path = tmp_path / "wrapped.fasta"
+    path.write_bytes(b">a first record\r\nACGT\r\nAC\r\n>b\nGG\nTT\n\n>c\n")
+    assert readfasta(str(path)) == [(">a first record", "ACGTAC"), (">b", "GGTT"), (">c", "")]
+    assert countrecords(str(path)) == 3
+    assert fastadimensions(str(path)) == (3, 6)
+    assert recordname(readfirst(str(path))[0]) == "a"
+
+def test_readfirst_empty(tmp_path):
+    empty = tmp_path / "empty.fasta"
+    empty.write_bytes(b"")
+    notfasta = tmp_path / "notfasta.fasta"
+    notfasta.write_bytes(b"ACGT\n")
+    assert readfirst(str(empty)) == (None, None)
+    assert readfirst(str(notfasta)) == (None, None)
+    assert countrecords(str(empty)) == 0
+
+def test_writerecords_roundtrip(tmp_path):
+    path = str(tmp_path / "out.fasta")
+    writerecords(path, [(">a", "ACGT")])
+    writerecords(path, [(">b", "TT")], "a")
+    assert readfasta(path) == [(">a", "ACGT"), (">b", "TT")]
+
+def test_alignment_columnstats(tmp_path):
+    path = tmp_path / "aligned.fasta"
+    path.write_text(">a\nAC-T\n>b\nACGT\n>c\nTCGA\n>d\nTCGA\n")
+    names, array = alignmentarray(str(path))
+    assert names == ["a", "b", "c", "d"]
+    assert array.shape == (4, 4)
+    stats = columnstats(array)
+    assert stats["constant"] == 2
+    assert stats["informative"] == 2
+    assert stats["gap_fraction"] == 1 / 16
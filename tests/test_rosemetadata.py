@@ -0,0 +1,27 @@
+"""Metadata parser end to end against the E-utilities stand-in"""
+from conftest import gbseq
+from rosemetadata import metaparser
+
+"""16S rRNA feature carrying its transcription, as NCBI annotates genomes"""
+RRNA = ("<GBFeature><GBFeature_key>rRNA</GBFeature_key><GBFeature_quals>"
+        "<GBQualifier><GBQualifier_name>product</GBQualifier_name><GBQualifier_value>16S ribosomal RNA</GBQualifier_value></GBQualifier>"
+        "<GBQualifier><GBQualifier_name>transcription</GBQualifier_name><GBQualifier_value>ACGUACGU</GBQualifier_value></GBQualifier>"
+        "</GBFeature_quals></GBFeature>")
+
+"""blastmetadata.xml in the layout rosetree has always written
+A genome without a 16S feature keeps its partial entry and the next entry reuses its number"""
+EXPECTED = ("<MetadataOutput><Info>Rosetree metadata from blast of sample1</Info><Dev>Part of program made by Fletcher Falk</Dev>"
+            "<Sequence><Sequence_num>1</Sequence_num><Sequence_accession>AB0001</Sequence_accession><Sequence_id>Escherichia coli</Sequence_id>"
+            "<Authors>['Falk,F.']</Authors><full_Sequence>aaaaaaaa</full_Sequence><Source><host>soil</host></Source></Sequence>"
+            "<Sequence><Sequence_num>2</Sequence_num><Sequence_accession>NC000002</Sequence_accession><Sequence_id>Bacillus subtilis</Sequence_id>"
+            "<Authors>['Falk,F.']</Authors></Sequence>"
+            "<Sequence><Sequence_num>2</Sequence_num><Sequence_accession>NC000001</Sequence_accession><Sequence_id>Escherichia coli</Sequence_id>"
+            "<Authors>['Falk,F.']</Authors><full_Sequence>ACGUACGU</full_Sequence><Source><host>soil</host></Source></Sequence>"
+            "</MetadataOutput>")
+
+def test_metaparser_xml(eutils, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    eutils.records["NC000001"] = gbseq("NC000001", 200, definition = "chromosome, complete genome", features = RRNA)
+    eutils.records["NC000002"] = gbseq("NC000002", 200, "Bacillus subtilis", definition = "chromosome, complete genome")
+    metaparser(["AB0001", "NC000002", "NC000001"], "sample1", fields = ("host",))
+    assert (tmp_path / "blastmetadata.xml").read_text() == EXPECTED
@@ -0,0 +1,45 @@
+"""Metadata store columns"""
+import sqlite3
+import pytest
+from rosemetastore import createstore, storefields, checkfields, writestore, records, exportxml, importxml
+
+def test_createstore_fields(tmp_path):
+    db = createstore(str(tmp_path / "store.sqlite"), ("host", "culture_collection"))
+    assert storefields(db) == ["host", "culture_collection"]
+    db.close()
+
+@pytest.mark.parametrize("field", ['host" TEXT); DROP TABLE info; --', "geo loc", "1host", ""])
+def test_createstore_rejects_field(tmp_path, field):
+    with pytest.raises(ValueError):
+        createstore(str(tmp_path / "store.sqlite"), ("host", field))
+
+@pytest.mark.parametrize("fields", [("host", "organism"), ("Host", "Accession"), ("sourcecount",)])
+def test_checkfields_rejects_reserved(fields):
+    with pytest.raises(ValueError):
+        checkfields(fields)
+
+def test_checkfields_dedupes_ignoring_case():
+    assert checkfields(("host", "Host", "strain", "host")) == ("host", "strain")
+
+def test_writestore_duplicate_fields(tmp_path):
+    path = str(tmp_path / "store.sqlite")
+    entry = {"num": 1, "accession": "AB0001", "organism": "Escherichia coli", "authors": None, "sequence": "ACGT",
+             "sources": [[("organism", "Escherichia coli"), ("host", "soil")]]}
+    writestore([entry], "info", "dev", path, ("host", "Host", "host"))
+    assert records(("host",), path) == {"AB0001": {"organism": "Escherichia coli", "genus": "Escherichia", "source": {"host": "soil"}}}
+
+def test_importxml_keeps_reserved_qualifiers_out_of_columns(tmp_path):
+    path, xmlpath = str(tmp_path / "store.sqlite"), str(tmp_path / "store.xml")
+    entry = {"num": 1, "accession": "AB0001", "organism": "Escherichia coli", "authors": None, "sequence": "ACGT",
+             "sources": [[("organism", "Escherichia coli"), ("strain", "K12")]]}
+    writestore([entry], "info", "dev", path)
+    exportxml(path, xmlpath)
+    with open(xmlpath, "rb") as xml:
+        exported = xml.read()
+    importxml(xmlpath, path)
+    db = sqlite3.connect(path)
+    assert "strain" in storefields(db) and "organism" not in storefields(db)
+    db.close()
+    exportxml(path, xmlpath)
+    with open(xmlpath, "rb") as xml:
+        assert xml.read() == exported
@@ -0,0 +1,22 @@
+"""Stage manifest and resume"""
+from rosestages import Manifest
+
+def test_resume_skips_unchanged_stages(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "input.txt").write_text("a")
+    calls = []
+    def stage():
+        calls.append(1)
+        (tmp_path / "output.txt").write_text("b")
+        return {"count": len(calls)}
+    Manifest().run("stage", stage, ["input.txt"], ["output.txt"], {"option": 1})
+    """Unchanged inputs and outputs skip the stage and return its recorded result"""
+    assert Manifest(resume = True).run("stage", stage, ["input.txt"], ["output.txt"], {"option": 1}) == {"count": 1}
+    """Changed parameters, inputs or outputs run it again"""
+    assert Manifest(resume = True).run("stage", stage, ["input.txt"], ["output.txt"], {"option": 2}) == {"count": 2}
+    (tmp_path / "input.txt").write_text("changed")
+    assert Manifest(resume = True).run("stage", stage, ["input.txt"], ["output.txt"], {"option": 2}) == {"count": 3}
+    (tmp_path / "output.txt").write_text("edited")
+    assert Manifest(resume = True).run("stage", stage, ["input.txt"], ["output.txt"], {"option": 2}) == {"count": 4}
+    """Without resume every stage runs"""
+    assert Manifest().run("stage", stage, ["input.txt"], ["output.txt"], {"option": 2}) == {"count": 5}
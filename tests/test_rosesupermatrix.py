@@ -0,0 +1,32 @@
+"""Supermatrix concatenation and partition files"""
+import pytest
+from rosefasta import readfasta
+from rosesupermatrix import concatenate, filtermarker, modelfromout
+
+def test_concatenate_fills_missing_taxa(tmp_path):
+    first = tmp_path / "16S.fasta.clipkit"
+    first.write_text(">a\nACGT\n>b\nACGA\n>c\nTCGA\n")
+    second = tmp_path / "rpoB.fasta.clipkit"
+    second.write_text(">c\nGGG\n>a\nGGC\n>d\nGCC\n")
+    output, partitionfile = str(tmp_path / "supermatrix.fasta"), str(tmp_path / "supermatrix.partition")
+    matrix = concatenate([("16S", str(first)), ("rpoB", str(second))], {"16S": "GTR+G4", "rpoB": "TIM2+I+G4"},
+                         output, partitionfile)
+    assert matrix == {"taxa": 4, "columns": 7, "partitions": [("16S", 1, 4), ("rpoB", 5, 7)]}
+    assert readfasta(output) == [(">a", "ACGTGGC"), (">b", "ACGA---"), (">c", "TCGAGGG"), (">d", "----GCC")]
+    with open(partitionfile) as partition:
+        assert partition.read() == "GTR+G4, 16S = 1-4\nTIM2+I+G4, rpoB = 5-7\n"
+
+def test_filtermarker(tmp_path):
+    marker = tmp_path / "rpoB.fasta"
+    marker.write_text(">a Escherichia coli\nAC\n>b Bacillus\nGT\n")
+    output = str(tmp_path / "rpoB.filtered.fasta")
+    assert filtermarker(str(marker), ["b", "z"], output) == 1
+    assert readfasta(output) == [(">b Bacillus", "GT")]
+
+def test_modelfromout(tmp_path):
+    out = tmp_path / "msa.out"
+    out.write_text("Best model according to BIC\n  > raxml-ng --msa msa --model TIM2+I+G4\n")
+    assert modelfromout(str(out)) == "TIM2+I+G4"
+    out.write_text("no model\n")
+    with pytest.raises(RuntimeError):
+        modelfromout(str(out))
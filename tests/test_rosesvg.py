@@ -0,0 +1,39 @@
+"""Headless renderer tree handling"""
+import pytest
+from rosesvg import parsenewick, setoutgroup, prune, search, draw
+
+def names(tree):
+    return sorted(leaf.name for leaf in tree.leaves())
+
+def test_parsenewick():
+    tree = parsenewick("((a:0.1,b:0.2)95:0.3,'c d':0.4[comment]);")
+    assert names(tree) == ["a", "b", "c d"]
+    clade = tree.children[0]
+    assert clade.support == 95.0
+    assert clade.dist == pytest.approx(0.3)
+    assert search(tree, "b").dist == pytest.approx(0.2)
+
+def test_setoutgroup():
+    tree = setoutgroup(parsenewick("((a:1,b:1):1,(c:1,d:1):1);"), "c")
+    assert names(tree) == ["a", "b", "c", "d"]
+    assert [child.name for child in tree.children][0] == "c"
+    assert sum(child.dist for child in tree.children) == pytest.approx(1)
+
+def test_prune():
+    tree = prune(parsenewick("((a:1,b:1):1,(c:1,d:1):1);"), ["a", "c", "d"])
+    assert tree.is_leaf() and tree.name == "b"
+    tree = prune(parsenewick("((a:1,b:1):1,(c:1,d:1):1);"), ["a"])
+    assert names(tree) == ["b", "c", "d"]
+    assert search(tree, "b").dist == pytest.approx(2)
+
+def test_deep_tree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    newick = "(t4999:1,t5000:1)"
+    for tip in range(4998, 0, -1):
+        newick = "(t%d:1,%s:1)" % (tip, newick)
+    tree = parsenewick(newick + ";")
+    assert len(tree.leaves()) == 5000
+    tree = prune(setoutgroup(tree, "t4000"), ["t1"])
+    assert len(tree.leaves()) == 4999
+    draw(tree, {}, "deep", {}, "svg")
+    assert (tmp_path / "deep.svg").stat().st_size > 0